@@ -2,6 +2,8 @@ import json
 import pathlib
 import pandas as pd
 
+from src.utils.memory import cast_floats
+
 
 BASE = pathlib.Path(__file__).resolve().parent.parent
 CACHE_OUTPUT = BASE / "cache" / "output" / "wti" / "mm"
@@ -14,7 +16,7 @@ def _load_json(path):
 
 
 class AppData:
-    def __init__(self):
+    def __init__(self, dtype="float64"):
         self.feature_definitions = _load_json(CACHE_OUTPUT / "feature_definitions.json")
 
         # Nowcast artifacts
@@ -36,7 +38,7 @@ class AppData:
         self.forecast_shap = _load_json(fc / "04_shap_values.json")
 
         # Dataset
-        self.dataset = pd.read_csv(DATASET_PATH, parse_dates=["tradeDate"])
+        self.dataset = cast_floats(pd.read_csv(DATASET_PATH, parse_dates=["tradeDate"]), dtype)
 
     # Convenience accessors by horizon
     def correlations(self, horizon):
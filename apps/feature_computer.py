@@ -1,9 +1,76 @@
-import numpy as np
+import pandas as pd
 
+from src.preprocessing.feature_computer import MODEL_FEATURES, compute_features as compute_feature_matrix, to_frame
+from src.preprocessing.feature_registry import DATASET_FEATURES, is_lagged
 
-def compute_features(raw: dict, beta_ols: float) -> dict:
+
+# Maps raw input ID prefixes of the inference tab to dataset column names
+RAW_INPUT_COLUMNS = {
+    "MM_NetPos": "ManagedMoney_NetPosition",
+    "MM_LongPos": "ManagedMoney_LongPosition",
+    "MM_ShortPos": "ManagedMoney_ShortPosition",
+    "AGG_OI": "AGG_OI",
+    "F1_OI": "F1_OI",
+    "F2_OI": "F2_OI",
+    "F1_Price": "F1_RolledPrice",
+    "F2_Price": "F2_RolledPrice",
+    "F3_Price": "F3_RolledPrice",
+    "F1_Vol20D": "F1_RolledPrice_rolling_20D_volatility",
+    "F2_Vol20D": "F2_RolledPrice_rolling_20D_volatility",
+    "F3_Vol20D": "F3_RolledPrice_rolling_20D_volatility",
+    "Cum5D_F1_Vol": "prior_cumulative_5D_F1_Volume",
+    "Cum5D_F2_Vol": "prior_cumulative_5D_F2_Volume",
+}
+
+# Maps time slot suffixes of the inference tab to the lag suffixes of the feature registry
+SLOT_SUFFIXES = {"_t": "", "_t1": "_t1", "_t2": "_t2", "_5d_ago": "_5d_ago"}
+
+
+def to_raw_frame(raw, beta_ols) -> pd.DataFrame:
+    """Rename tab inputs (e.g. MM_NetPos_t1) to registry inputs (e.g. ManagedMoney_NetPosition_t1).
+
+    Parameters
+    ----------
+    raw : pd.DataFrame or dict of scalars or arrays keyed like MM_NetPos_t
+    beta_ols : float or array — OLS beta for synthetic spread, used for every week
+    """
+    raw = to_frame(raw)
+    columns = {}
+    for key in raw.columns:
+        for slot, suffix in SLOT_SUFFIXES.items():
+            prefix = key[: -len(slot)]
+            if key.endswith(slot) and prefix in RAW_INPUT_COLUMNS:
+                columns[key] = RAW_INPUT_COLUMNS[prefix] + suffix
+                break
+    frame = raw.rename(columns=columns)
+    for suffix in ("", "_t1", "_t2"):
+        frame[f"beta_ols_10{suffix}"] = beta_ols
+    return frame
+
+
+def check_explicit_lags(frame: pd.DataFrame, features: list = MODEL_FEATURES) -> None:
+    """Raise if features need a lagged input that the rows do not carry.
+
+    The registry derives a missing lagged raw input (e.g. F1_RolledPrice_t1) by shifting the column, which is
+    only right for a time ordered report series; tab rows are independent, so every lag must be given.
+    """
+    to_compute = DATASET_FEATURES.resolve(features, available=frame.columns)
+    shifted = [name for name in to_compute
+               if is_lagged(name) and not any(is_lagged(i) for i in DATASET_FEATURES[name].inputs)]
+    if shifted:
+        tab_inputs = {column + suffix: prefix + slot
+                      for prefix, column in RAW_INPUT_COLUMNS.items()
+                      for slot, suffix in SLOT_SUFFIXES.items()}
+        missing = [tab_inputs.get(name, name) for name in shifted]
+        raise ValueError(f"Missing lagged inputs {missing}: each row must carry its own lagged values")
+
+
+def compute_features(raw, beta_ols) -> dict:
     """Compute the 20 model features from ~33 raw user inputs.
 
+    Features go through the same vectorized computation as DataSetBuilder; see
+    compute_features_batch to score many rows at once.
+
     Parameters
     ----------
     raw : dict with keys like MM_NetPos_t, MM_NetPos_t1, MM_NetPos_t2,
@@ -14,69 +81,12 @@ def compute_features(raw: dict, beta_ols: float) -> dict:
           Cum5D_F1_Vol_t/t1, Cum5D_F2_Vol_t/t1
     beta_ols : float — OLS beta for synthetic spread
     """
-    f = {}
-
-    # --- COT position changes (features 1-3) ---
-    net_chg_t = raw["MM_NetPos_t"] - raw["MM_NetPos_t1"]
-    net_chg_t1 = raw["MM_NetPos_t1"] - raw["MM_NetPos_t2"]
-    f["prior_report_ManagedMoney_NetPosition_change"] = net_chg_t1
-
-    long_chg_t = raw["MM_LongPos_t"] - raw["MM_LongPos_t1"]
-    long_chg_t1 = raw["MM_LongPos_t1"] - raw["MM_LongPos_t2"]
-    f["prior_report_ManagedMoney_LongPosition_change"] = long_chg_t1
-
-    short_chg_t = raw["MM_ShortPos_t"] - raw["MM_ShortPos_t1"]
-    short_chg_t1 = raw["MM_ShortPos_t1"] - raw["MM_ShortPos_t2"]
-    f["prior_report_ManagedMoney_ShortPosition_change"] = short_chg_t1
-
-    # --- Position-to-OI changes (features 4-6) ---
-    net_oi_t = raw["MM_NetPos_t"] / raw["AGG_OI_t"]
-    net_oi_t1 = raw["MM_NetPos_t1"] / raw["AGG_OI_t1"]
-    net_oi_t2 = raw["MM_NetPos_t2"] / raw["AGG_OI_t2"]
-    f["prior_report_ManagedMoney_NetPosition_to_openinterest_change"] = net_oi_t1 - net_oi_t2
-
-    long_oi_t = raw["MM_LongPos_t"] / raw["AGG_OI_t"]
-    long_oi_t1 = raw["MM_LongPos_t1"] / raw["AGG_OI_t1"]
-    long_oi_t2 = raw["MM_LongPos_t2"] / raw["AGG_OI_t2"]
-    f["prior_report_ManagedMoney_LongPosition_to_openinterest_change"] = long_oi_t1 - long_oi_t2
-
-    short_oi_t = raw["MM_ShortPos_t"] / raw["AGG_OI_t"]
-    short_oi_t1 = raw["MM_ShortPos_t1"] / raw["AGG_OI_t1"]
-    short_oi_t2 = raw["MM_ShortPos_t2"] / raw["AGG_OI_t2"]
-    f["prior_report_ManagedMoney_ShortPosition_to_openinterest_change"] = short_oi_t1 - short_oi_t2
-
-    # --- Synthetic spread change (feature 7) ---
-    spread_t = raw["F1_Price_t"] - beta_ols * raw["F2_Price_t"]
-    spread_t1 = raw["F1_Price_t1"] - beta_ols * raw["F2_Price_t1"]
-    spread_t2 = raw["F1_Price_t2"] - beta_ols * raw["F2_Price_t2"]
-    synth_chg_t = spread_t - spread_t1
-    synth_chg_t1 = spread_t1 - spread_t2
-    f["prior_report_SyntheticF1MinusF2_RolledPrice_change"] = synth_chg_t1
-
-    # --- Volume changes (features 8-10) ---
-    f1_vol_chg = raw["Cum5D_F1_Vol_t"] - raw["Cum5D_F1_Vol_t1"]
-    f2_vol_chg = raw["Cum5D_F2_Vol_t"] - raw["Cum5D_F2_Vol_t1"]
-    f["prior_cumulative_5D_F1_Volume_change"] = f1_vol_chg
-    f["prior_cumulative_5D_F2_Volume_change"] = f2_vol_chg
-    f["prior_cumulative_5D_F1MinusF2_Volume_change"] = f1_vol_chg - f2_vol_chg
-
-    # --- OI changes (features 11-14) ---
-    f1_oi_chg = raw["F1_OI_t"] - raw["F1_OI_5d_ago"]
-    f2_oi_chg = raw["F2_OI_t"] - raw["F2_OI_5d_ago"]
-    agg_oi_chg = raw["AGG_OI_t"] - raw["AGG_OI_5d_ago"]
-    f["prior_5D_F1_OI_change"] = f1_oi_chg
-    f["prior_5D_F2_OI_change"] = f2_oi_chg
-    f["prior_5D_AGG_OI_change"] = agg_oi_chg
-    f["prior_5D_F1MinusF2_openinterest_change"] = f1_oi_chg - f2_oi_chg
-
-    # --- Volatility (features 15-17) — user-provided directly ---
-    f["F1_RolledPrice_rolling_20D_volatility"] = raw["F1_Vol20D_t"]
-    f["F2_RolledPrice_rolling_20D_volatility"] = raw["F2_Vol20D_t"]
-    f["F3_RolledPrice_rolling_20D_volatility"] = raw["F3_Vol20D_t"]
-
-    # --- Price changes (features 18-20) ---
-    f["F1_RolledPrice_change"] = raw["F1_Price_t"] - raw["F1_Price_t1"]
-    f["F2_RolledPrice_change"] = raw["F2_Price_t"] - raw["F2_Price_t1"]
-    f["F3_RolledPrice_change"] = raw["F3_Price_t"] - raw["F3_Price_t1"]
-
-    return f
+    features = compute_features_batch(raw, beta_ols)
+    return {k: float(v) for k, v in features.iloc[0].items()}
+
+
+def compute_features_batch(raw, beta_ols) -> pd.DataFrame:
+    """Compute the model features for every row of raw inputs (one row, a what-if grid, or history)."""
+    frame = to_raw_frame(raw, beta_ols)
+    check_explicit_lags(frame)
+    return compute_feature_matrix(frame, features=MODEL_FEATURES)
@@ -1,3 +1,5 @@
+import json
+
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import (
@@ -7,6 +9,14 @@ from sklearn.ensemble import (
     RandomForestRegressor,
 )
 from sklearn.linear_model import ElasticNet, Lasso, LinearRegression, Ridge, SGDRegressor
+from sklearn.multioutput import MultiOutputRegressor
+
+
+def _build_enet(params):
+    """ElasticNet for the squared error loss, as build_estimator_from_trial, else the elasticnet SGDRegressor"""
+    if params.get("loss", "squared_error") == "squared_error":
+        return ElasticNet(alpha=params["alpha"], l1_ratio=params["l1_ratio"], random_state=42)
+    return SGDRegressor(random_state=42, penalty="elasticnet", **params)
 
 
 MODEL_CONSTRUCTORS = {
@@ -16,10 +26,17 @@ MODEL_CONSTRUCTORS = {
     "extra": lambda p: ExtraTreesRegressor(random_state=42, **p),
     "hgbm": lambda p: HistGradientBoostingRegressor(random_state=42, **p),
     "ols": lambda _: LinearRegression(),
-    "enet": lambda p: SGDRegressor(random_state=42, **p),
+    "enet": _build_enet,
 }
 
 
+def _as_multi_output(estimator):
+    """estimator itself when it fits several responses natively, else one copy per response"""
+    if estimator.__sklearn_tags__().target_tags.multi_output:
+        return estimator
+    return MultiOutputRegressor(estimator)
+
+
 class InferenceEngine:
     def __init__(self, dataset, selected_features_by_horizon, selected_models_by_horizon):
         """
@@ -28,56 +45,104 @@ class InferenceEngine:
         dataset : pd.DataFrame
         selected_features_by_horizon : dict  {horizon: {response: [features]}}
         selected_models_by_horizon : dict    {horizon: {response: {model_name, params}} or None}
+
+        Responses of a horizon that share the model, its params, the features and the rows they are known on are
+        fitted jointly, by one multi-output estimator.
         """
-        self.estimators = {}  # (horizon, response) -> fitted estimator
+        self.estimators = {}  # (horizon, response) -> fitted estimator, shared by jointly fitted responses
         self.feature_lists = {}  # (horizon, response) -> [feature_names]
+        self.output_columns = {}  # (horizon, response) -> column of the estimator output, None if single output
 
         for horizon in ("nowcast", "forecast"):
             feat_map = selected_features_by_horizon.get(horizon)
             model_map = selected_models_by_horizon.get(horizon)
             if feat_map is None or model_map is None:
                 continue
+            # group the responses fitted with the same model on the same features
+            groups = {}
+            fitted = {}
             for response, features in feat_map.items():
                 if response not in model_map:
                     continue
                 model_info = model_map[response]
-                model_name = model_info["model_name"]
-                params = model_info["params"]
+                key = (model_info["model_name"], json.dumps(model_info["params"], sort_keys=True), tuple(features))
+                groups.setdefault(key, []).append(response)
 
-                # Prepare data
-                cols = features + [response]
-                sub = dataset[cols].dropna()
-                if len(sub) < 10:
-                    continue
-                X = sub[features].values
-                y = sub[response].values
+            for (model_name, params, features), responses in groups.items():
+                params = json.loads(params)
+                features = list(features)
+                # Prepare data: responses are only fitted together when they are known on the same rows
+                known = dataset[features].notna().all(axis=1)
+                row_sets = {}
+                for response in responses:
+                    rows = (known & dataset[response].notna()).to_numpy()
+                    row_sets.setdefault(rows.tobytes(), (rows, []))[1].append(response)
+
+                for rows, group in row_sets.values():
+                    if rows.sum() < 10:
+                        continue
+                    X = dataset.loc[rows, features].values
 
-                # Fit
-                est = MODEL_CONSTRUCTORS[model_name](params)
-                est.fit(X, y)
+                    # Fit
+                    est = MODEL_CONSTRUCTORS[model_name](params)
+                    if len(group) > 1:
+                        est = _as_multi_output(est)
+                        est.fit(X, dataset.loc[rows, group].values)
+                    else:
+                        est.fit(X, dataset.loc[rows, group[0]].values)
 
-                self.estimators[(horizon, response)] = est
-                self.feature_lists[(horizon, response)] = features
+                    for column, response in enumerate(group):
+                        fitted[response] = (est, features, column if len(group) > 1 else None)
+
+            # in the order of the responses of the horizon
+            for response in feat_map:
+                if response in fitted:
+                    key = (horizon, response)
+                    self.estimators[key], self.feature_lists[key], self.output_columns[key] = fitted[response]
+
+    def _predict(self, key, X, outputs):
+        """Predictions of the response of key; outputs holds the predictions of the estimators already run on X,
+        so that jointly fitted responses share one predict call"""
+        est = self.estimators[key]
+        if id(est) not in outputs:
+            outputs[id(est)] = est.predict(X)
+        prediction = outputs[id(est)]
+        column = self.output_columns[key]
+        return prediction if column is None else prediction[:, column]
 
     def predict(self, horizon, features_dict):
         """Return {response: predicted_value} for the given horizon."""
         results = {}
+        outputs = {}
         for (h, response), est in self.estimators.items():
             if h != horizon:
                 continue
             feat_names = self.feature_lists[(h, response)]
             try:
                 X = np.array([[features_dict[fn] for fn in feat_names]])
-                pred = est.predict(X)[0]
+                pred = self._predict((h, response), X, outputs)[0]
                 results[response] = pred
             except (KeyError, ValueError):
                 results[response] = None
         return results
 
+    def predict_batch(self, horizon, features):
+        """Return a DataFrame of predictions, one column per response, for every row of features."""
+        results = {}
+        outputs = {}
+        for (h, response), est in self.estimators.items():
+            if h != horizon:
+                continue
+            X = features[self.feature_lists[(h, response)]].values
+            results[response] = self._predict((h, response), X, outputs)
+        return pd.DataFrame(results, index=features.index)
+
     def get_model_info(self, horizon, response):
         """Return (model_name, feature_list) or None."""
         key = (horizon, response)
         if key not in self.estimators:
             return None
         est = self.estimators[key]
+        if isinstance(est, MultiOutputRegressor):
+            est = est.estimator
         return type(est).__name__, self.feature_lists[key]
@@ -3,26 +3,11 @@ from dash import Input, Output, State, dcc, html, callback_context
 import numpy as np
 import pandas as pd
 
-from apps.feature_computer import compute_features
+from apps.feature_computer import RAW_INPUT_COLUMNS, compute_features
 
 
 # Maps raw input ID suffixes to dataset column names for pre-filling
-_PREFILL_MAP_T = {
-    "MM_NetPos": "ManagedMoney_NetPosition",
-    "MM_LongPos": "ManagedMoney_LongPosition",
-    "MM_ShortPos": "ManagedMoney_ShortPosition",
-    "AGG_OI": "AGG_OI",
-    "F1_OI": "F1_OI",
-    "F2_OI": "F2_OI",
-    "F1_Price": "F1_RolledPrice",
-    "F2_Price": "F2_RolledPrice",
-    "F3_Price": "F3_RolledPrice",
-    "F1_Vol20D": "F1_RolledPrice_rolling_20D_volatility",
-    "F2_Vol20D": "F2_RolledPrice_rolling_20D_volatility",
-    "F3_Vol20D": "F3_RolledPrice_rolling_20D_volatility",
-    "Cum5D_F1_Vol": "prior_cumulative_5D_F1_Volume",
-    "Cum5D_F2_Vol": "prior_cumulative_5D_F2_Volume",
-}
+_PREFILL_MAP_T = RAW_INPUT_COLUMNS
 
 # All raw input field definitions: (id_suffix, label, time_slots)
 # time_slots is a list of suffixes like "_t", "_t1", "_t2"
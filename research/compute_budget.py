@@ -0,0 +1,86 @@
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from joblib import parallel_config
+from sklearn.base import BaseEstimator, clone
+from threadpoolctl import threadpool_limits
+
+
+# user overrides of the automatic budget, see set_compute_budget
+COMPUTE_BUDGET = {"n_cores": None, "outer_jobs": None, "inner_jobs": None, "blas_threads": None}
+
+
+def available_cores() -> int:
+    """Number of cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+@dataclass(frozen=True)
+class ComputeBudget:
+    """Split of the cores between the levels of a nested computation
+
+    Attributes:
+        outer_jobs: joblib workers over the independent tasks (CV splits, features, ...).
+        inner_jobs: n_jobs of the estimators fitted inside each worker.
+        blas_threads: BLAS/OpenMP threads of each worker.
+    """
+    outer_jobs: int
+    inner_jobs: int
+    blas_threads: int
+
+    def configure(self, estimator: BaseEstimator) -> BaseEstimator:
+        """Unfitted copy of estimator with every n_jobs parameter (pipeline steps included) set to inner_jobs"""
+        estimator = clone(estimator)
+        n_jobs = {name: self.inner_jobs for name in estimator.get_params(deep=True) if name.endswith("n_jobs")}
+        if n_jobs:
+            estimator.set_params(**n_jobs)
+        return estimator
+
+    @contextmanager
+    def limits(self):
+        """Caps the BLAS/OpenMP threads of this process and of the joblib workers started within the context"""
+        with threadpool_limits(limits=self.blas_threads), \
+                parallel_config(backend="loky", inner_max_num_threads=self.blas_threads):
+            yield
+
+
+def set_compute_budget(**budget) -> None:
+    """Overrides the automatic budget, e.g. set_compute_budget(n_cores=16) or set_compute_budget(outer_jobs=4)
+
+    Args:
+        n_cores: cores shared by the levels, all available cores by default.
+        outer_jobs, inner_jobs, blas_threads: fixed values of the levels, see ComputeBudget. None restores the
+            automatic choice.
+    """
+    unknown = set(budget) - set(COMPUTE_BUDGET)
+    if unknown:
+        raise ValueError(f"Unknown compute budget settings {sorted(unknown)}, expected {list(COMPUTE_BUDGET)}")
+    COMPUTE_BUDGET.update(budget)
+
+
+def get_compute_budget(n_tasks: int = None, outer_jobs: int = None) -> ComputeBudget:
+    """Budget of a computation over n_tasks independent tasks
+
+    Unless set with set_compute_budget, the outer level takes as many workers as there are tasks, up to the number
+    of cores, and the cores left per worker go to the estimators n_jobs and to BLAS, so that the workers together
+    do not use more threads than cores.
+
+    Args:
+        n_tasks: number of independent tasks of the outer level (e.g. CV splits).
+        outer_jobs: n_jobs requested by the caller, takes precedence over the settings. -1 means all cores.
+    """
+    n_cores = COMPUTE_BUDGET["n_cores"] or available_cores()
+    if outer_jobs is None:
+        outer_jobs = COMPUTE_BUDGET["outer_jobs"]
+    if outer_jobs is None or outer_jobs < 0:
+        outer_jobs = n_cores if outer_jobs is None else max(n_cores + 1 + outer_jobs, 1)
+        outer_jobs = min(outer_jobs, n_tasks) if n_tasks else outer_jobs
+    outer_jobs = max(int(outer_jobs), 1)
+    per_worker = max(n_cores // outer_jobs, 1)
+    inner_jobs = COMPUTE_BUDGET["inner_jobs"] or per_worker
+    # an estimator either parallelizes itself (trees) or through BLAS/OpenMP (linear models, boosting)
+    blas_threads = COMPUTE_BUDGET["blas_threads"] or per_worker
+    return ComputeBudget(outer_jobs=outer_jobs, inner_jobs=inner_jobs, blas_threads=blas_threads)
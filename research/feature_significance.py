@@ -4,6 +4,7 @@ from sklearn.base import BaseEstimator
 from sklearn.inspection import permutation_importance
 from sklearn.model_selection import cross_val_predict
 
+from research.compute_budget import get_compute_budget
 from research.model_selection.PurgedKFold import PurgedKFold
 from research.plots import plot_heatmap
 def get_single_feature_importance(dataset: pd.DataFrame,
@@ -37,16 +38,18 @@ def get_single_feature_importance(dataset: pd.DataFrame,
                 n_purge = n_purge
 
             )
-            yhat = cross_val_predict(
-                estimator = model,
-                X=Xy[[feat]],
-                y=Xy[target],
-                method = 'predict',
-                cv=cv,
-                n_jobs = 8,
-                verbose = 0
-
-            )
+            budget = get_compute_budget(n_tasks=n_splits)
+            with budget.limits():
+                yhat = cross_val_predict(
+                    estimator = budget.configure(model),
+                    X=Xy[[feat]],
+                    y=Xy[target],
+                    method = 'predict',
+                    cv=cv,
+                    n_jobs = budget.outer_jobs,
+                    verbose = 0
+
+                )
             oos_predicted_actual_correlation_net.append(
                 pd.DataFrame(
                     {'y': Xy[target],
@@ -114,17 +117,21 @@ def get_feature_permutation_importance(
                 print(f'Fold: {i}')
             train_data = Xy.iloc[train_index,:]
             train_data.reset_index(drop=True, inplace = True)
-            model.fit(train_data[features], train_data[target])
-
-            pi_result = permutation_importance(
-                model,
-                X=train_data[features],
-                y=train_data[target],
-                scoring='r2',
-                n_jobs=8,
-                n_repeats=4
-
-            )
+            # the fit gets all the cores, the permutations are spread over the features
+            with get_compute_budget(n_tasks=1).limits():
+                model.fit(train_data[features], train_data[target])
+
+            budget = get_compute_budget(n_tasks=len(features))
+            with budget.limits():
+                pi_result = permutation_importance(
+                    model,
+                    X=train_data[features],
+                    y=train_data[target],
+                    scoring='r2',
+                    n_jobs=budget.outer_jobs,
+                    n_repeats=4
+
+                )
             # TO BE RE CHECKED
             pi_df = pd.DataFrame({i: pi_result['importances_mean']})
             pi_df.index = features
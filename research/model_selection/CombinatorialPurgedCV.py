@@ -1,39 +1,102 @@
-from joblib import Parallel, delayed
+import os
+import tempfile
 
+from joblib import Parallel, delayed, dump, load
 
-from sklearn.base import BaseEstimator
 
+from sklearn.base import BaseEstimator, clone
+from sklearn.multioutput import MultiOutputRegressor
+
+from functools import lru_cache
 from math import comb
-from typing import Generator, Union
+from typing import Callable, Generator, Union
 import pandas as pd
 import numpy as np
 from itertools import combinations
 
+from research.compute_budget import get_compute_budget
+from research.model_selection.early_stopping import EarlyStopping
+from research.model_selection.prediction_cache import FoldPredictionCache
+
+
+def _partition_labels(n_samples: int, n_partitions: int) -> np.ndarray:
+    """Partition of each index, the last partition taking the remainder"""
+    return np.minimum(np.arange(n_samples) // (n_samples // n_partitions), n_partitions - 1)
+
+
+@lru_cache(maxsize=32)
+def _get_splits(n_samples: int,
+                n_partitions: int,
+                k: int,
+                purge_amount: int,
+                embargo_amount: int,
+                chunk_size: int = 256) -> tuple:
+    """Train/test indices of every combination, computed once per configuration and shared across calls
+
+    Masks are built for chunks of combinations at once: a (n_partitions, n_samples) matrix marks the rows each
+    test partition removes from the training set (the partition itself, the purge before it and the embargo
+    after it), and a product with the combination/partition incidence matrix gives every train mask of the chunk.
+
+    Returns:
+        tuple of (train, test) read-only int32 index arrays, one per combination.
+    """
+    indices = np.arange(n_samples)
+    positions = indices.astype(np.int32)
+    partition_size = n_samples // n_partitions
+    labels = _partition_labels(n_samples, n_partitions)
+    starts = np.arange(n_partitions) * partition_size
+    ends = np.append(starts[1:], n_samples)
+
+    removed = ((indices[None, :] >= (starts - purge_amount)[:, None])
+               & (indices[None, :] < (ends + embargo_amount)[:, None])).astype(np.float32)
+
+    all_combinations = np.array(list(combinations(range(n_partitions), k)), dtype=np.int32).reshape(-1, k)
+    splits = []
+    for chunk_start in range(0, len(all_combinations), chunk_size):
+        chunk = all_combinations[chunk_start: chunk_start + chunk_size]
+        # float32 so that the product goes through BLAS, counts are exact far beyond any n_partitions
+        incidence = np.zeros((len(chunk), n_partitions), dtype=np.float32)
+        np.put_along_axis(incidence, chunk, 1, axis=1)
+        test_masks = incidence[:, labels] > 0
+        train_masks = (incidence @ removed) == 0
+        for train_mask, test_mask in zip(train_masks, test_masks):
+            train = positions[train_mask]
+            test = positions[test_mask]
+            train.setflags(write=False)
+            test.setflags(write=False)
+            splits.append((train, test))
+    return tuple(splits)
+
 
 class CombinatorialPurgedCV():
 
     """Combinatorial Purged Cross-Validatpr with Purging
 
-    This class identifies training and testing indicies that split the data into train/test sets. It also implements purging to avoid lookahead bias.
-
+    This class identifies training and testing indicies that split the data into train/test sets. It also implements purging to avoid lookahead bias,
+    and an embargo on the indices that follow each test partition.
 
+    The splits only depend on (n_samples, n_partitions, k, purge_amount, embargo_amount); they are computed once per configuration
+    and reused by every call to split, e.g. across Optuna trials and responses.
     """
 
     def __init__(self,
                  n_partitions: int,
                  k:int,
-                 purge_amount: int):
+                 purge_amount: int,
+                 embargo_amount: int = 0):
         """
 
         Args:
         :param n_partitions: the total number of partitions
         :param k: the number of partitions to include in the test set
         :param purge_amount: the number of indices to be purged between train/test sets
+        :param embargo_amount: the number of indices after each test partition excluded from the train set
         """
         self.n_splits =  comb(n_partitions, k)
         self.n_partitions = n_partitions
         self.k = k
         self.purge_amount = purge_amount
+        self.embargo_amount = embargo_amount
 
     def split(self,
               X: Union[np.ndarray, pd.Series, pd.DataFrame],
@@ -47,36 +110,13 @@ class CombinatorialPurgedCV():
              y: the target variable for supervised learning problems.
              groups: Group labels for the samples used while splitting the dataset into train/test set.
         Yields:
-            train (np.ndarray): The training set indices for that split
-            test (np.ndarray): the testing set indices for that split
+            train (np.ndarray): The training set indices for that split (read-only, shared between calls)
+            test (np.ndarray): the testing set indices for that split (read-only, shared between calls)
         """
         if isinstance(X, pd.Series) | isinstance(X, pd.DataFrame):
             assert X.index.is_monotonic_increasing, "The indices of  X need to be in ascending order"
-        n_samples = len(X)
-        indices = np.arange(n_samples)
-        partition_size = n_samples // self.n_partitions
-
-        partitions = [indices[i* partition_size: (i+1) * partition_size ]  for i in range(self.n_partitions -1) ]
-        partitions.append(indices[(self.n_partitions -1) * partition_size: ])
-
-        test_combinations = combinations (range(self.n_partitions) , self.k )
-        for test_indices in test_combinations:
-            test_indices = list(test_indices)
-            train_indices = list(set(range(self.n_partitions)) - set(test_indices))
-            test_mask = np.zeros(n_samples, dtype=bool)
-            train_mask = np.zeros(n_samples, dtype=bool)
-
-            for i in test_indices:
-                test_mask[partitions[i][0]:partitions[i][-1]+1 ] = True
-
-            for i in train_indices:
-                train_mask[partitions[i][0]:partitions[i][-1] + 1] = True
-
-            # Apply purging by shifting the train_mask to exclude purge_amount indices before each test partition
-            for test_index in test_indices:
-                start_index = max(partitions[test_index][0] - self.purge_amount, 0 )
-                train_mask[start_index: partitions[test_index][0] ] = False
-            yield indices[train_mask], indices[test_mask]
+        yield from _get_splits(len(X), self.n_partitions, self.k, int(self.purge_amount), int(self.embargo_amount))
+
     def get_n_splits(self,
                      X: np.ndarray = None,
                      y:np.ndarray=None,
@@ -90,6 +130,10 @@ class CombinatorialPurgedCV():
         """
         return self.n_splits
 
+    def get_n_paths(self) -> int:
+        """Returns the number of backtest paths, C(n_partitions - 1, k - 1): each partition is tested in that many splits"""
+        return comb(self.n_partitions - 1, self.k - 1)
+
 
 
 def _fit_and_predict(estimator: BaseEstimator,
@@ -98,7 +142,9 @@ def _fit_and_predict(estimator: BaseEstimator,
                      train: np.ndarray,
                      test: np.ndarray,
                      fit_params: dict,
-                     method: str)->pd.DataFrame:
+                     method: str,
+                     columns: list = None,
+                     early_stopping: EarlyStopping = None)->pd.DataFrame:
 
 
     if isinstance(X, pd.DataFrame):
@@ -112,7 +158,13 @@ def _fit_and_predict(estimator: BaseEstimator,
     else:
         raise ValueError("X must be either a pd.DataFrame or np.ndarray")
     fit_params = fit_params if fit_params is not None else {}
-    estimator.fit(X_train, y_train, **fit_params)
+    n_iter = None
+    if early_stopping is not None and early_stopping.supports(estimator):
+        # a fresh copy, partial_fit would otherwise resume from the previous split in sequential runs
+        estimator = clone(estimator)
+        n_iter = early_stopping.fit(estimator, X, y, train)
+    else:
+        estimator.fit(X_train, y_train, **fit_params)
     func = getattr(estimator, method, None)
     if func is None:
         raise ValueError(f"Estimator must have a {method} method")
@@ -121,11 +173,47 @@ def _fit_and_predict(estimator: BaseEstimator,
     if method == "predict_proba":
         predictions_df = pd.DataFrame(predictions, columns=[f"posterior_{i}" for i in range(predictions.shape[1])])
         predictions_df["index"] = test
+    elif columns is not None:
+        # multi-output: one column of predictions per response
+        predictions_df = pd.DataFrame(np.asarray(predictions).reshape(len(test), -1), columns=columns)
+        predictions_df["index"] = test
     else:
         predictions_df  = pd.DataFrame({"yhat": predictions, "index": test})
+    if n_iter is not None:
+        predictions_df.attrs["n_iter"] = n_iter
 
     return  predictions_df
 
+def _as_contiguous(data: Union[pd.DataFrame, pd.Series, np.ndarray, None]) -> Union[np.ndarray, None]:
+    """ C-contiguous float64 array of a design matrix or response, converted once for all splits """
+    if data is None:
+        return None
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        data = data.to_numpy()
+    return np.ascontiguousarray(data, dtype=np.float64)
+
+
+def as_multi_output(estimator: BaseEstimator) -> BaseEstimator:
+    """estimator itself when it fits several responses natively (forests, linear models), else one copy per
+    response through MultiOutputRegressor"""
+    if estimator.__sklearn_tags__().target_tags.multi_output:
+        return estimator
+    return MultiOutputRegressor(estimator)
+
+
+def _share_arrays(arrays: dict, folder: str) -> dict:
+    """ Dumps arrays to folder and reopens them as read-only memory maps, which workers open instead of copying """
+    shared = {}
+    for name, array in arrays.items():
+        if array is None:
+            shared[name] = None
+            continue
+        path = os.path.join(folder, f"{name}.mmap")
+        dump(array, path)
+        shared[name] = load(path, mmap_mode="r")
+    return shared
+
+
 def cpcv_predict(
         estimator: BaseEstimator,
         X:pd.DataFrame,
@@ -134,23 +222,95 @@ def cpcv_predict(
         n_jobs: int = None,
         verbose: bool = False,
         fit_params: dict = None,
-        method: str = "predict" ) -> pd.Series:
-
-
+        method: str = "predict",
+        return_split_predictions: bool = False,
+        cache: FoldPredictionCache = None,
+        cache_key: str = None,
+        early_stopping: EarlyStopping = None,
+        batch_size: int = None,
+        on_batch: Callable = None) -> pd.Series:
+    """Out-of-sample predictions of every CPCV split, averaged per index
+
+    With return_split_predictions, the predictions of every split (a DataFrame of yhat and index per split, in
+    split order) are returned as well, from which get_backtest_paths assembles the backtest paths without refitting.
+
+    X and y are converted once to contiguous float arrays. With several workers they are published as read-only
+    memory maps in a temporary folder, so each split only sends its train/test indices and the workers slice the
+    shared arrays instead of receiving a pickled copy of the data.
+
+    n_jobs=None takes the workers from the compute budget (see research.compute_budget). Either way the estimator
+    n_jobs and the BLAS threads of the workers are capped so that the splits do not oversubscribe the cores.
+
+    With a FoldPredictionCache and the cache_key of (X, y, estimator), the splits already in the cache are read
+    instead of fitted and the fitted ones are stored (method="predict" only).
+
+    When y is a DataFrame of several responses, each split fits all of them at once (see as_multi_output) and the
+    predictions are a DataFrame with one column per response, as are the split predictions; see
+    get_response_correlations.
+
+    With early_stopping, boosting and SGD estimators are stopped on a purged validation slice at the end of each
+    training fold (see EarlyStopping) and the iteration they stopped at is kept in the attrs["n_iter"] of their
+    split predictions, those read from the cache included. The cache_key must then identify the early stopping
+    settings too.
+
+    With on_batch, the splits are evaluated in their combination order by batches of batch_size (the number of
+    workers by default) and on_batch(n_done, split_predictions) is called after each batch with the predictions of
+    the first n_done splits, e.g. to report intermediate scores; an exception it raises stops the evaluation.
+    """
+    if early_stopping is not None:
+        early_stopping = early_stopping.for_cv(cv)
     cpcv_splits = list(cv.split(X))
-    parallel  = Parallel(n_jobs=n_jobs, verbose=verbose)
-    predictions = parallel(
-                    delayed(_fit_and_predict)(
-                            estimator=estimator,
-                             X=X,
-                            y=y,
-                            train=train,
-                            test=test,
-                            fit_params=fit_params,
-                           method=method)
-                           for train, test in cpcv_splits
-
-                           )
+    responses = list(y.columns) if isinstance(y, pd.DataFrame) and method == "predict" else None
+    columns = responses or ["yhat"]
+    use_cache = cache is not None and method == "predict"
+    split_predictions = [None] * len(cpcv_splits)
+    if use_cache:
+        for i, (train, test) in enumerate(cpcv_splits):
+            yhat = cache.load(cache_key, train, test)
+            if yhat is not None:
+                split_predictions[i] = pd.DataFrame(yhat.reshape(len(test), -1), columns=columns).assign(index=test)
+                n_iter = cache.load_n_iter(cache_key, train, test)
+                if n_iter is not None:
+                    split_predictions[i].attrs["n_iter"] = n_iter
+    missing = [i for i, predictions in enumerate(split_predictions) if predictions is None]
+    if missing or on_batch is not None:
+        budget = get_compute_budget(n_tasks=max(len(missing), 1), outer_jobs=n_jobs)
+        # without a callback all the splits form one batch
+        batch_size = len(cpcv_splits) if on_batch is None else (batch_size or budget.outer_jobs)
+        estimator = budget.configure(estimator)
+        if responses is not None:
+            estimator = as_multi_output(estimator)
+        arrays = {"X": _as_contiguous(X), "y": _as_contiguous(y)} if missing else {}
+        with tempfile.TemporaryDirectory(prefix="cpcv_") as folder, budget.limits(), \
+                Parallel(n_jobs=budget.outer_jobs, verbose=verbose) as parallel:
+            if missing and budget.outer_jobs != 1:
+                arrays = _share_arrays(arrays, folder)
+            for start in range(0, len(cpcv_splits), batch_size):
+                end = min(start + batch_size, len(cpcv_splits))
+                batch = [i for i in missing if start <= i < end]
+                fitted = parallel(
+                                delayed(_fit_and_predict)(
+                                        estimator=estimator,
+                                        X=arrays["X"],
+                                        y=arrays["y"],
+                                        train=cpcv_splits[i][0],
+                                        test=cpcv_splits[i][1],
+                                        fit_params=fit_params,
+                                       method=method,
+                                       columns=responses,
+                                       early_stopping=early_stopping)
+                                       for i in batch
+
+                                       ) if batch else []
+                for i, predictions in zip(batch, fitted):
+                    split_predictions[i] = predictions
+                    if use_cache:
+                        cache.save(cache_key, *cpcv_splits[i], predictions[columns].to_numpy(),
+                                   n_iter=predictions.attrs.get("n_iter"))
+                if on_batch is not None:
+                    on_batch(end, split_predictions[:end])
+            del arrays
+    predictions = split_predictions
     # aggregate multiple predictions
 
     if method == "predict_proba":
@@ -158,10 +318,70 @@ def cpcv_predict(
         predictions=predictions.groupby("index").mean()#.reset_index()
     elif method == "predict":
         # predictions = pd.concat(predictions).groupby("index").reset_index()["yhat"]
-        predictions = pd.concat(predictions).groupby("index").mean().reset_index()["yhat"]
+        predictions = pd.concat(predictions).groupby("index").mean().reset_index()
+        predictions = predictions[responses] if responses is not None else predictions["yhat"]
 
         # predictions = pd.concat(predictions).groupby("index").mean(axis=1).reset_index()["yhat"]
 
+    if return_split_predictions:
+        return predictions, split_predictions
     return predictions
 
 
+def get_response_correlations(predictions: pd.DataFrame, y: pd.DataFrame) -> pd.Series:
+    """Correlation between each response and its multi-output cpcv_predict predictions, over the finite pairs"""
+    correlations = {}
+    for response in predictions.columns:
+        y_true = np.asarray(y[response], dtype=float)
+        y_pred = predictions[response].to_numpy(dtype=float)
+        mask = np.isfinite(y_true) & np.isfinite(y_pred)
+        correlations[response] = np.corrcoef(y_true[mask], y_pred[mask])[0, 1] if mask.sum() > 1 else np.nan
+    return pd.Series(correlations, name="correlation")
+
+
+def get_backtest_paths(split_predictions: list,
+                       cv: CombinatorialPurgedCV,
+                       n_samples: int) -> np.ndarray:
+    """Assembles the backtest paths of a CPCV run from the predictions of its splits
+
+    Every partition is tested in C(n_partitions - 1, k - 1) splits. Path j takes, for each partition, the
+    predictions of the j-th split (in combination order) that tests it, so each path covers every index once.
+
+    Args:
+        split_predictions: per split predictions returned by cpcv_predict with return_split_predictions=True.
+        cv: the cross-validator used to produce them.
+        n_samples: number of samples of X.
+    Returns:
+        np.ndarray: (n_paths, n_samples) predictions, one row per backtest path.
+    """
+    combos = np.array(list(combinations(range(cv.n_partitions), cv.k))).reshape(-1, cv.k)
+    if len(combos) != len(split_predictions):
+        raise ValueError(f"Expected {len(combos)} split predictions, got {len(split_predictions)}")
+    # rank of each split among the splits testing each of its partitions
+    incidence = np.zeros((len(combos), cv.n_partitions), dtype=int)
+    np.put_along_axis(incidence, combos, 1, axis=1)
+    path_of = np.cumsum(incidence, axis=0) - 1
+
+    labels = _partition_labels(n_samples, cv.n_partitions)
+    paths = np.full((cv.get_n_paths(), n_samples), np.nan)
+    for split, predictions in enumerate(split_predictions):
+        index = predictions["index"].to_numpy()
+        paths[path_of[split, labels[index]], index] = predictions["yhat"].to_numpy()
+    return paths
+
+
+def get_path_correlations(paths: np.ndarray, y: Union[pd.Series, np.ndarray]) -> np.ndarray:
+    """Correlation between y and each backtest path, over the indices where both are finite
+
+    Returns:
+        np.ndarray: one correlation per path, the distribution of the CPCV performance.
+    """
+    y = np.asarray(y, dtype=float)
+    correlations = np.full(len(paths), np.nan)
+    for i, path in enumerate(paths):
+        mask = np.isfinite(path) & np.isfinite(y)
+        if mask.sum() > 1:
+            correlations[i] = np.corrcoef(y[mask], path[mask])[0, 1]
+    return correlations
+
+
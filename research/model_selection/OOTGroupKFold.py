@@ -1,7 +1,6 @@
 
 import itertools
 import math
-import random
 
 from typing import Generator, Iterator, Tuple, Union
 
@@ -13,18 +12,25 @@ from sklearn.model_selection._split import BaseCrossValidator, _BaseKFold
 
 from research.model_selection.CombinatorialPurgedCV import CombinatorialPurgedCV
 class OOTGroupKFold:
+    """Out-of-ticker CPCV: the tickers are split in two groups, each trained on the CPCV train rows of its group and
+    tested on the CPCV test rows of the other group (restricted to tickers present in the train rows).
+
+    Tickers are shuffled once with random_state. In split, every row gets the integer code of its ticker and each
+    CPCV split is intersected with the two groups by boolean mask arithmetic, without membership tests on the frame.
+    """
 
     def __init__(self,
                  n_splits: int,
                  tickers: pd.Series,
                  k:int = 2,
                  purge_amount: Union[int, float]=0,
-                 verbose: bool=False
+                 verbose: bool=False,
+                 random_state: Union[int, None] = 42
                  ):
         self.n_splits = n_splits
-        self.tickers = tickers.unique()
         self.ticker_column_name = tickers.name
-        random.shuffle(self.tickers)
+        self.random_state = random_state
+        self.tickers = np.random.default_rng(random_state).permutation(tickers.unique())
         self.k=k
         self.purge_amount = purge_amount
         self.purge_amount_rows = self.purge_amount
@@ -35,6 +41,10 @@ class OOTGroupKFold:
         half = len(self.tickers) // 2
         return np.arange(half), np.arange(half, len(self.tickers))
 
+    def _ticker_codes(self, X: pd.DataFrame) -> np.ndarray:
+        """Position of the ticker of every row in self.tickers, -1 for tickers unknown to the splitter"""
+        return pd.Index(self.tickers).get_indexer(X[self.ticker_column_name])
+
     def  split(self, X: pd.DataFrame) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
         assert np.array_equal(X.index, np.arange(len(X))), (
             "The index of X should be contiguous integers. "
@@ -51,32 +61,29 @@ class OOTGroupKFold:
 
         )
         group_a, group_b = self._ticker_groups()
+        n_tickers = len(self.tickers)
+        codes = self._ticker_codes(X)
+        known = codes >= 0
+        in_group_a = known & np.isin(codes, group_a)
+        in_group_b = known & np.isin(codes, group_b)
+        train_mask = np.zeros(len(X), dtype=bool)
+        test_mask = np.zeros(len(X), dtype=bool)
         for train_index, test_index in cpcv.split(X):
-            # determine the tickers in the training set
-            train_tickers = self.tickers[
-                np.isin(
-                    self.tickers, X.iloc[train_index][self.ticker_column_name].unique()
-                )
-            ]
-            # Split the train tickers into two groups
-            train_group_a = train_tickers[np.isin(train_tickers, self.tickers[group_a])]
-            train_group_b = train_tickers[np.isin(train_tickers, self.tickers[group_b])]
+            train_mask[:] = False
+            train_mask[train_index] = True
+            test_mask[:] = False
+            test_mask[test_index] = True
+            # tickers with at least one row in the training set
+            train_codes = codes[train_index]
+            present = np.bincount(train_codes[train_codes >= 0], minlength=n_tickers) > 0
+            in_train_tickers = known & present[codes]
 
             # Generate indices for train and test sets for each ticker group
-            train_indices_a = X.index[
-                X[self.ticker_column_name].isin(train_group_a) & X.index.isin(train_index)
-            ].values
-            test_indices_a = X.index[
-                X[self.ticker_column_name].isin(train_group_b) & X.index.isin(test_index)
-                ].values
-
-
-            train_indices_b = X.index[
-                X[self.ticker_column_name].isin(train_group_b) & X.index.isin(train_index)
-            ].values
-            test_indices_b = X.index[
-                X[self.ticker_column_name].isin(train_group_a) & X.index.isin(test_index)
-                ].values
+            train_indices_a = np.flatnonzero(train_mask & in_group_a)
+            test_indices_a = np.flatnonzero(test_mask & in_group_b & in_train_tickers)
+
+            train_indices_b = np.flatnonzero(train_mask & in_group_b)
+            test_indices_b = np.flatnonzero(test_mask & in_group_a & in_train_tickers)
 
             if self.verbose:
                 print(
@@ -1,5 +1,3 @@
-import itertools
-
 import numpy as np
 import pandas as pd
 from pandas import Index
@@ -24,9 +22,25 @@ class PurgedKFold(_BaseKFold):
         self.n_embargo = n_embargo
         self.n_splits = n_splits
         self.date_column = date_column
-        # Get unique dates
-        self.unq_dates = data[self.date_column].unique()
-        self.unq_dates.sort()
+        # Get unique dates, and the position of the date of every row among them
+        self.unq_dates, self.date_ordinals = np.unique(data[self.date_column].to_numpy(), return_inverse=True)
+
+    def _fold_bounds(self) -> np.ndarray:
+        """ First date ordinal of every fold, and the number of dates as the end of the last one (array_split sizes) """
+        sizes = np.full(self.n_splits, len(self.unq_dates) // self.n_splits)
+        sizes[: len(self.unq_dates) % self.n_splits] += 1
+        return np.concatenate([[0], np.cumsum(sizes)])
+
+    def _fold_masks(self, i: int, bounds: np.ndarray) -> tuple:
+        """ Train and test row masks of fold i
+
+        The test fold covers the dates [start, end). The n_purge dates before it are purged, and the n_purge +
+        n_embargo dates after it are purged and embargoed; the first fold has no dates before, the last none after.
+        """
+        start, end = bounds[i], bounds[i + 1]
+        test_mask = (self.date_ordinals >= start) & (self.date_ordinals < end)
+        train_mask = (self.date_ordinals < start - self.n_purge) | (self.date_ordinals >= end + self.n_purge + self.n_embargo)
+        return train_mask, test_mask
 
     def split(self,
               X: pd.DataFrame,
@@ -36,20 +50,9 @@ class PurgedKFold(_BaseKFold):
         data_index = self.data.index
         if (X.index != data_index).any():
             raise ValueError("Index of X and data must be identical")
-        date_splits = np.array_split(self.unq_dates, self.n_splits)
+        bounds = self._fold_bounds()
         for i in range(self.n_splits):
-            if i ==0:
-                pre_dates = np.array([], dtype = "datetime64[ns]")
-            else:
-                pre_dates = np.concatenate(date_splits[:i])
-                pre_dates = pre_dates[: -self.n_purge]
-            if i == self.n_splits-1:
-                post_dates = np.concatenate(date_splits[i+1 :])
-                post_dates = post_dates[self.n_purge+self.n_embargo : ]
-            test_dates = date_splits[i]
-            train_dates = np.concatenate([pre_dates, post_dates])
-            train_mask = self.data[self.date_column].isin(train_dates)
-            test_mask = self.data[self.date_column].isin(test_dates)
+            train_mask, test_mask = self._fold_masks(i, bounds)
             train_index = data_index[train_mask]
             test_index = data_index[test_mask]
             yield train_index, test_index
@@ -61,38 +64,26 @@ class PurgedKFold(_BaseKFold):
         return self.n_splits
     def visualize(self, X: pd.DataFrame) -> pd.DataFrame:
         """ Returns the representation of train/test dates formed by the CV."""
-        unique_dates = self.data[self.date_column].unique().tolist()
-        split_counter = 1
-        df_list = []
-        for train_idx, test_idx in self.split(X):
-            d = {"split": split_counter}
-            test = self.data.loc[test_idx]
-            train = self.data.loc[train_idx]
-            train_dates = set(train[self.date_column].unique().tolist())
-            test_dates = set(test[self.date_column].unique().tolist())
-            for date in unique_dates:
-                if date in train_dates:
-                    d[date] = "train"
-                elif date in test_dates:
-                    d[date] = "test"
-                else:
-                    d[date] = ""
-            df_list.append(d)
-            split_counter +=1
-        date_df = pd.DataFrame(df_list)
-        date_df = date_df.set_index("split")
-        date_df = date_df.T
+        if (X.index != self.data.index).any():
+            raise ValueError("Index of X and data must be identical")
+        bounds = self._fold_bounds()
+        ordinals = np.arange(len(self.unq_dates))[:, None]
+        starts, ends = bounds[:-1][None, :], bounds[1:][None, :]
+        table = np.full((len(self.unq_dates), self.n_splits), "", dtype=object)
+        table[(ordinals < starts - self.n_purge) | (ordinals >= ends + self.n_purge + self.n_embargo)] = "train"
+        table[(ordinals >= starts) & (ordinals < ends)] = "test"
+        date_df = pd.DataFrame(table, index=self.unq_dates, columns=pd.RangeIndex(1, self.n_splits + 1, name="split"))
         return date_df
 
     def __repr__(self)-> str:
         """ Represents the class instance in a debug context """
         ret = "PurgedKFold\n"
-        ret += f"\tdata points: {len(self.data):, .0f}\n"
+        ret += f"\tdata points: {len(self.data):,}\n"
         ret +=f"\tdate column: {self.date_column }\n"
         ret += f"\tunique dates: {len(self.unq_dates)}\n"
-        ret += f"\tpurge dates: {len(self.n_purge)}\n"
-        ret += f"\tembargo dates: {len(self.n_embargo)}\n"
-        ret += f"\tn_splits: {len(self.n_splits)}\n"
+        ret += f"\tpurge dates: {self.n_purge}\n"
+        ret += f"\tembargo dates: {self.n_embargo}\n"
+        ret += f"\tn_splits: {self.n_splits}\n"
         return ret
 
     def __str__(self)->str:
@@ -0,0 +1,128 @@
+from dataclasses import dataclass, replace
+from typing import Union
+
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, clone
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.linear_model import SGDRegressor
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.pipeline import Pipeline
+
+
+@dataclass(frozen=True)
+class EarlyStopping:
+    """Early stopping of iterative estimators on a purged, time-ordered validation slice of each training fold
+
+    The validation slice is the latest validation_fraction of the training rows, and the purge_amount training rows
+    before it are dropped, so that the estimator is stopped on data that follows what it is fitted on, as the test
+    fold would. HistGradientBoostingRegressor stops its boosting iterations on the slice (X_val/y_val);
+    SGDRegressor runs one partial_fit epoch at a time until the slice loss stops improving or max_iter epochs.
+    Other estimators are fitted as usual on the whole training fold. A MultiOutputRegressor of several responses
+    (see as_multi_output) stops the copy of each response on its own validation loss.
+
+    Attributes:
+        validation_fraction: share of the training rows held out for validation, taken at the end.
+        purge_amount: training rows dropped before the validation slice, that of the cross-validator when None.
+        n_iter_no_change: iterations without improvement of the validation loss before stopping.
+        tol: minimal improvement of the validation mean squared error, relative to the variance of the validation
+            response (the error of a constant prediction).
+    """
+    validation_fraction: float = 0.1
+    purge_amount: Union[int, None] = None
+    n_iter_no_change: int = 10
+    tol: float = 1e-4
+
+    def for_cv(self, cv) -> "EarlyStopping":
+        """Early stopping purging as much as cv when purge_amount is not set"""
+        if self.purge_amount is not None:
+            return self
+        return replace(self, purge_amount=int(getattr(cv, "purge_amount", 0)))
+
+    @staticmethod
+    def _final_step(estimator: BaseEstimator) -> BaseEstimator:
+        if isinstance(estimator, MultiOutputRegressor):
+            estimator = estimator.estimator
+        return estimator.steps[-1][1] if isinstance(estimator, Pipeline) else estimator
+
+    def supports(self, estimator: BaseEstimator) -> bool:
+        """Whether the estimator (or the last step of a pipeline, per response for a MultiOutputRegressor) can be
+        stopped early"""
+        return isinstance(self._final_step(estimator), (HistGradientBoostingRegressor, SGDRegressor))
+
+    def split_train(self, train: np.ndarray) -> tuple:
+        """Fit and validation rows of a training fold: the last rows validate, the purge_amount rows before them
+        are dropped"""
+        train = np.sort(np.asarray(train))
+        n_validation = max(int(np.ceil(self.validation_fraction * len(train))), 1)
+        validation = train[-n_validation:]
+        fit = train[:-n_validation]
+        fit = fit[fit < validation[0] - (self.purge_amount or 0)]
+        return fit, validation
+
+    def fit(self,
+            estimator: BaseEstimator,
+            X: Union[pd.DataFrame, np.ndarray],
+            y: Union[pd.Series, np.ndarray],
+            train: np.ndarray) -> int:
+        """Fits estimator on the train rows of (X, y) with early stopping
+
+        Returns:
+            int: the number of iterations (boosting iterations or SGD epochs) the estimator stopped at, the median
+            over the responses for a MultiOutputRegressor.
+        """
+        X = X.to_numpy() if isinstance(X, pd.DataFrame) else np.asarray(X)
+        y = y.to_numpy() if isinstance(y, (pd.Series, pd.DataFrame)) else np.asarray(y)
+        if isinstance(estimator, MultiOutputRegressor):
+            y = y.reshape(len(y), -1)
+            estimator.estimators_ = [clone(estimator.estimator) for _ in range(y.shape[1])]
+            estimator.n_features_in_ = X.shape[1]
+            n_iter = [self.fit(response_estimator, X, y[:, j], train)
+                      for j, response_estimator in enumerate(estimator.estimators_)]
+            return int(np.median(n_iter))
+        fit, validation = self.split_train(train)
+        X_fit, y_fit, X_val, y_val = X[fit], y[fit], X[validation], y[validation]
+        model = self._final_step(estimator)
+        if isinstance(estimator, Pipeline) and len(estimator.steps) > 1:
+            # the preprocessing only sees the fit rows, as the test fold only sees the training rows
+            preprocessing = Pipeline(estimator.steps[:-1])
+            X_fit = preprocessing.fit_transform(X_fit, y_fit)
+            X_val = preprocessing.transform(X_val)
+
+        tol = self.tol * np.var(y_val)
+        if isinstance(model, HistGradientBoostingRegressor):
+            # the validation score of the squared error loss is minus half the mean squared error
+            model.set_params(early_stopping=True, scoring="loss", n_iter_no_change=self.n_iter_no_change, tol=tol / 2)
+            model.fit(X_fit, y_fit, X_val=X_val, y_val=y_val)
+            return int(model.n_iter_)
+
+        best_loss, n_no_change, epoch = np.inf, 0, 0
+        for epoch in range(1, model.max_iter + 1):
+            model.partial_fit(X_fit, y_fit)
+            loss = np.mean((model.predict(X_val) - y_val) ** 2)
+            if loss < best_loss - tol:
+                best_loss, n_no_change = loss, 0
+            else:
+                n_no_change += 1
+                if n_no_change >= self.n_iter_no_change:
+                    break
+        return epoch
+
+    def for_refit(self, estimator: BaseEstimator, n_iter: list = None) -> BaseEstimator:
+        """Unfitted copy of estimator to refit on the whole data as its CV folds were fitted
+
+        The copy runs the median of the iterations its folds stopped at without early stopping, or its own max_iter
+        when none is known (folds of a cache written before the iterations were kept): sklearn's built-in early
+        stopping would validate on a random rather than time-ordered split.
+        """
+        estimator = clone(estimator)
+        if not self.supports(estimator):
+            return estimator
+        model = self._final_step(estimator)
+        n_iter = [n for n in (n_iter or []) if n is not None]
+        # SGD runs exactly max_iter epochs without tol, boosting without early stopping
+        stopping = {"tol": None} if isinstance(model, SGDRegressor) else {"early_stopping": False}
+        if n_iter:
+            stopping["max_iter"] = max(int(np.median(n_iter)), 1)
+        model.set_params(**stopping)
+        return estimator
@@ -1,55 +1,98 @@
 
 
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
 
 import optuna
 from optuna import pruners
+from optuna.storages import JournalStorage
+from optuna.storages.journal import JournalFileBackend
+from optuna.study import MaxTrialsCallback
 
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_squared_error
 
-from sklearn.linear_model import SGDRegressor, Lasso, Ridge, LinearRegression
+from sklearn.linear_model import SGDRegressor, ElasticNet, Lasso, Ridge, LinearRegression
 from sklearn.ensemble import RandomForestRegressor, ExtraTreesRegressor, HistGradientBoostingRegressor
 from sklearn.model_selection._split import BaseCrossValidator
-from research.model_selection.CombinatorialPurgedCV import cpcv_predict  
+from research.model_selection.CombinatorialPurgedCV import (CombinatorialPurgedCV, as_multi_output, cpcv_predict,
+                                                             get_backtest_paths, get_path_correlations,
+                                                             get_response_correlations)
+from research.compute_budget import get_compute_budget, set_compute_budget
+from research.model_selection.early_stopping import EarlyStopping
+from research.model_selection.prediction_cache import (FOLD_PREDICTION_CACHE_DIR, FoldPredictionCache,
+                                                       canonical_params, hash_arrays)
+from research.model_selection.linear_cpcv import (PATH_MODELS, SufficientStatistics, linear_cpcv_path_predict,
+                                                  linear_cpcv_predict, out_of_split_path_predict, path_correlations,
+                                                  supports)
 
 RANDOM_STATE = 42
+# search range of alpha per regularized linear family, also the span of the alpha paths
+ALPHA_RANGES = {"enet": (1e-6, 1e-1), "lasso": (1e-6, 1e1), "ridge": (1e-6, 1e3)}
+STUDY_STORAGE_DIR = Path(__file__).resolve().parents[2] / "cache" / "studies"
+FINISHED_STATES = (optuna.trial.TrialState.COMPLETE, optuna.trial.TrialState.PRUNED)
+
+
+class PrunerMethod(Enum):
+    MEDIAN = "median"                          # prune below the median of the previous trials at the same step
+    SUCCESSIVE_HALVING = "successive_halving"  # keep the top third of the trials at each rung of splits
+
+
+def _suggest_alpha(trial: optuna.Trial, model_name: str, alpha_path: int = None):
+    """alpha of a regularized linear family, None when the trial evaluates the alpha path of its family instead"""
+    if alpha_path:
+        return None
+    return trial.suggest_float("alpha", *ALPHA_RANGES[model_name], log=True)
+
+
+def build_estimator_from_trial(trial: optuna.Trial, alpha_path: int = None):
+    """Choose a model family and its hyperparameters conditionally.
 
-def build_estimator_from_trial(trial: optuna.Trial):
-    """Choose a model family and its hyperparameters conditionally."""
+    With alpha_path, the families with an alpha path (see linear_cpcv.PATH_MODELS and supports) do not sample alpha:
+    the path replaces it, and the estimator is only the key of its fold predictions.
+    """
     model_name = trial.suggest_categorical(
         "model",
         ["enet", "lasso", "ols", "ridge", "rf", "extra", "hgbm"]
     )
 
     if model_name == "enet":
-        alpha = trial.suggest_float("alpha", 1e-6, 1e-1, log=True)
         l1_ratio = trial.suggest_float("l1_ratio", 0.0, 1.0)
         loss = trial.suggest_categorical("loss", ["squared_error", "huber"])
         # (Optional) huber epsilon if chosen
         epsilon = trial.suggest_float("epsilon", 1e-3, 0.2) if loss == "huber" else 0.1
-        base = SGDRegressor(
-            penalty="elasticnet",
-            alpha=alpha,
-            l1_ratio=l1_ratio,
-            loss=loss,
-            epsilon=epsilon,
-            max_iter=3000,
-            tol=1e-3,
-            random_state=RANDOM_STATE
-        )
+        # the huber loss has no alpha path
+        alpha = _suggest_alpha(trial, "enet", alpha_path if loss == "squared_error" else None)
+        if loss == "squared_error":
+            # same objective as the elasticnet SGDRegressor, solved exactly as the linear CPCV path scores it
+            base = ElasticNet(alpha=alpha, l1_ratio=l1_ratio, random_state=RANDOM_STATE)
+        else:
+            base = SGDRegressor(
+                penalty="elasticnet",
+                alpha=alpha,
+                l1_ratio=l1_ratio,
+                loss=loss,
+                epsilon=epsilon,
+                max_iter=3000,
+                tol=1e-3,
+                random_state=RANDOM_STATE
+            )
         # linear models benefit from scaling
         est = Pipeline([("scaler", StandardScaler()), ("model", base)])
 
     elif model_name == "lasso":
-        alpha = trial.suggest_float("alpha", 1e-6, 1e1, log=True)
+        alpha = _suggest_alpha(trial, "lasso", alpha_path)
         base = Lasso(alpha=alpha, random_state=RANDOM_STATE)
         est = Pipeline([("scaler", StandardScaler()), ("model", base)])
 
     elif model_name == "ridge":
-        alpha = trial.suggest_float("alpha", 1e-6, 1e3, log=True)
+        alpha = _suggest_alpha(trial, "ridge", alpha_path)
         base = Ridge(alpha=alpha, random_state=RANDOM_STATE)
         est = Pipeline([("scaler", StandardScaler()), ("model", base)])
 
@@ -103,65 +146,321 @@ def build_estimator_from_trial(trial: optuna.Trial):
     return est
 
 
-def objective(trial, Xy, feature_names, response_name, cv, n_jobs_cpcv=10 ):
-    estimator = build_estimator_from_trial(trial)
+def get_alpha_grid(model_name: str, n_alphas: int) -> np.ndarray:
+    """Log-spaced alphas spanning the search range of a regularized linear family"""
+    low, high = ALPHA_RANGES[model_name]
+    return np.logspace(np.log10(low), np.log10(high), n_alphas)
+
+
+def get_running_correlation(split_predictions: list, Xy: pd.DataFrame, response_name) -> float:
+    """Correlation of the predictions averaged over the splits evaluated so far, on the indices they tested, averaged
+    over the responses when response_name is a list"""
+    predictions = pd.concat(split_predictions).groupby("index").mean()
+    responses = list(response_name) if isinstance(response_name, (list, tuple)) else [response_name]
+    if not isinstance(response_name, (list, tuple)):
+        predictions = predictions.rename(columns={"yhat": response_name})
+    y = Xy[responses].iloc[predictions.index].reset_index(drop=True)
+    return float(get_response_correlations(predictions[responses].reset_index(drop=True), y).mean())
+
+
+def objective(trial, Xy, feature_names, response_name, cv, n_jobs_cpcv=None, statistics=None, alpha_path=None,
+              cache=None, dataset_key=None, early_stopping=None, fold_batch_size=None):
+    multi_response = isinstance(response_name, (list, tuple))
+    # the jointly fitted responses have no alpha path
+    estimator = build_estimator_from_trial(trial, alpha_path=None if multi_response else alpha_path)
+    model_name = trial.params["model"]
+
+    n_splits = cv.get_n_splits()
+
+    def report(n_done, split_predictions):
+        # running score after n_done splits, in split order, so that the pruner compares trials on the same splits
+        trial.report(get_running_correlation(split_predictions, Xy, response_name), step=n_done)
+        # a fully evaluated trial always completes, only the intermediate steps can prune it
+        if n_done < n_splits and trial.should_prune():
+            raise optuna.TrialPruned()
+
+    if cache is not None and dataset_key is None:
+        dataset_key = hash_arrays(Xy[feature_names], Xy[response_name])
+
+    def cache_key(solver, **parts):
+        # fold predictions are shared by every trial, study and response with the same data and configuration
+        if cache is None:
+            return None
+        return cache.key(dataset=dataset_key, features=list(feature_names), response=response_name, solver=solver,
+                         **parts)
+
+    if multi_response:
+        # several responses fitted jointly on every split, the trial scores their mean correlation
+        responses = list(response_name)
+        stopping = early_stopping if early_stopping is not None and early_stopping.supports(estimator) else None
+        y_pred, split_predictions = cpcv_predict(
+            estimator,
+            Xy[feature_names],
+            Xy[responses],
+            cv=cv,
+            method="predict",
+            n_jobs=n_jobs_cpcv,
+            return_split_predictions=True,
+            cache=cache,
+            cache_key=cache_key("estimator_multi_output", params=canonical_params(estimator),
+                                early_stopping=vars(stopping.for_cv(cv)) if stopping else None),
+            early_stopping=stopping,
+            batch_size=fold_batch_size,
+            on_batch=report
+        )
+        if stopping is not None:
+            # median over the responses of the iterations each fold stopped at
+            trial.set_user_attr("n_iter", [predictions.attrs.get("n_iter") for predictions in split_predictions])
+        correlations = get_response_correlations(y_pred, Xy[responses])
+        trial.set_user_attr("response_correlations", correlations.to_dict())
+        if correlations.isna().all():
+            # no response gives a correlation, the trial fails
+            return float("nan")
+        return float(correlations.mean())
 
     y_true = Xy[response_name].values
-    y_pred  = cpcv_predict(
-        estimator,
-        Xy[feature_names],
-        Xy[response_name],
-        cv=cv,
-        method="predict",
-        n_jobs=n_jobs_cpcv
-    )
+    if alpha_path and model_name in PATH_MODELS and supports(model_name, trial.params):
+        # whole regularization path in one pass over the splits
+        alphas = get_alpha_grid(model_name, alpha_path)
+        predictions, path_splits = linear_cpcv_path_predict(
+            model_name,
+            trial.params,
+            alphas,
+            Xy[feature_names],
+            Xy[response_name],
+            cv=cv,
+            statistics=statistics,
+            return_split_predictions=True,
+            cache=cache,
+            cache_key=cache_key("sufficient_statistics_path", alphas=alphas.tolist(),
+                                params=canonical_params(estimator, exclude=("alpha",)))
+        )
+        correlations = path_correlations(predictions, y_true)
+        if np.isnan(correlations).all():
+            # no alpha gives a correlation, the trial fails
+            return float("nan")
+        # refit alpha, chosen on the whole path
+        trial.set_user_attr("alpha_path", alphas.tolist())
+        trial.set_user_attr("alpha_path_correlations", correlations.tolist())
+        trial.set_user_attr("best_alpha", float(alphas[int(np.nanargmax(correlations))]))
+        # the trial scores the alphas chosen out of each split, comparable with the single configuration trials
+        y_pred, split_predictions, selected = out_of_split_path_predict(path_splits, y_true, n_samples=len(Xy))
+        trial.set_user_attr("split_alphas", alphas[selected].tolist())
+        report(len(split_predictions), split_predictions)
+    elif supports(model_name, trial.params):
+        # linear families: every split is solved from the per partition sufficient statistics
+        y_pred, split_predictions = linear_cpcv_predict(
+            model_name,
+            trial.params,
+            Xy[feature_names],
+            Xy[response_name],
+            cv=cv,
+            statistics=statistics,
+            return_split_predictions=True,
+            cache=cache,
+            cache_key=cache_key("sufficient_statistics", params=canonical_params(estimator))
+        )
+        # solved in milliseconds, a single report of the final score, which never prunes
+        report(len(split_predictions), split_predictions)
+    else:
+        stopping = early_stopping if early_stopping is not None and early_stopping.supports(estimator) else None
+        y_pred, split_predictions = cpcv_predict(
+            estimator,
+            Xy[feature_names],
+            Xy[response_name],
+            cv=cv,
+            method="predict",
+            n_jobs=n_jobs_cpcv,
+            return_split_predictions=True,
+            cache=cache,
+            cache_key=cache_key("estimator", params=canonical_params(estimator),
+                                early_stopping=vars(stopping.for_cv(cv)) if stopping else None),
+            early_stopping=stopping,
+            batch_size=fold_batch_size,
+            on_batch=report
+        )
+        if stopping is not None:
+            # iterations each fold stopped at
+            trial.set_user_attr("n_iter", [predictions.attrs.get("n_iter") for predictions in split_predictions])
+    if isinstance(cv, CombinatorialPurgedCV):
+        # dispersion of the performance across the backtest paths, from the same fits
+        paths = get_backtest_paths(split_predictions, cv, n_samples=len(Xy))
+        trial.set_user_attr("path_correlations", get_path_correlations(paths, y_true).tolist())
 
     y_pred = np.asarray(y_pred, float).ravel()
     mask = np.isfinite(y_pred)
     y_true_m = y_true[mask]
     y_pred_m = y_pred[mask]
     if y_pred_m.size == 0:
-        return 1e9
+        return float("nan")
 
     val = np.corrcoef(y_true_m, y_pred_m)[0,1]
-    
 
+    return float(val)
+def _trial_params(trial: optuna.trial.FrozenTrial) -> dict:
+    """Params of a trial, with the best alpha of its regularization path when it evaluated one"""
+    if "best_alpha" in trial.user_attrs:
+        return {**trial.params, "alpha": trial.user_attrs["best_alpha"]}
+    return trial.params
+
+
+def build_pruner(method: PrunerMethod, batch_size: int) -> pruners.BasePruner:
+    """Pruner over the running CPCV correlation reported every batch_size splits"""
+    method = PrunerMethod(method)
+    if method == PrunerMethod.MEDIAN:
+        # trials are not pruned on their first batch
+        return pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=batch_size + 1)
+    return pruners.SuccessiveHalvingPruner(min_resource=batch_size, reduction_factor=3)
+
+
+def get_study_name(ticker: str, investor: str, horizon: str, response: str) -> str:
+    """Name of the persisted study of a ticker, investor category, horizon (nowcast/forecast) and response"""
+    if isinstance(response, (list, tuple)):
+        response = "+".join(response)
+    return f"{ticker}_{investor}_{horizon}_{response}"
+
+
+def get_study_storage(study_name: str, storage_dir: str = STUDY_STORAGE_DIR) -> JournalStorage:
+    """Journal file storage of a study, one file per study in storage_dir
+
+    The journal file is appended to under a file lock, so that several processes can run trials of the same study.
+    """
+    path = Path(storage_dir) / f"{study_name}.journal"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return JournalStorage(JournalFileBackend(str(path)))
+
+
+def _optimize(study_name: str,
+              storage_dir: str,
+              n_trials: int,
+              seed: int,
+              pruner: PrunerMethod,
+              n_cores: int,
+              show_progress_bar: bool,
+              objective_kwargs: dict) -> optuna.Study:
+    """Runs trials in this process until the study holds n_trials finished (complete or pruned) trials"""
+    if n_cores is not None:
+        # share of the cores of a study worker process
+        set_compute_budget(n_cores=n_cores)
+    fold_batch_size = objective_kwargs["fold_batch_size"]
+    if fold_batch_size is None:
+        fold_batch_size = get_compute_budget(n_tasks=objective_kwargs["cv"].get_n_splits(),
+                                             outer_jobs=objective_kwargs["n_jobs_cpcv"]).outer_jobs
+    objective_kwargs = dict(objective_kwargs, fold_batch_size=fold_batch_size)
+    study = optuna.create_study(
+        study_name=study_name,
+        storage=get_study_storage(study_name, storage_dir) if study_name is not None else None,
+        load_if_exists=True,
+        direction="maximize",
+        sampler=optuna.samplers.TPESampler(seed=seed),
+        pruner=build_pruner(pruner, fold_batch_size)
+    )
+    remaining = n_trials - len(study.get_trials(deepcopy=False, states=FINISHED_STATES))
+    if remaining > 0:
+        study.optimize(
+            lambda t: objective(t, **objective_kwargs),
+            n_trials=remaining,
+            # other workers add trials to the same study
+            callbacks=[MaxTrialsCallback(n_trials, states=FINISHED_STATES)],
+            show_progress_bar=show_progress_bar
+        )
+    return study
 
-    trial.report(float(val), step=0)
-    if trial.should_prune():
-        raise optuna.TrialPruned()
 
-    return float(val)
 def find_best_model(Xy: pd.DataFrame, 
                    feature_names: list[str], 
                    response_name: str, 
                    cv:BaseCrossValidator,
                    n_trials: int = 50,
-                   n_jobs_cpcv: int = 10,
-                   seed: int = 42):
+                   n_jobs_cpcv: int = None,
+                   seed: int = 42,
+                   alpha_path: int = None,
+                   cache_dir: str = FOLD_PREDICTION_CACHE_DIR,
+                   early_stopping: EarlyStopping = None,
+                   pruner: PrunerMethod = PrunerMethod.MEDIAN,
+                   fold_batch_size: int = None,
+                   study_name: str = None,
+                   storage_dir: str = STUDY_STORAGE_DIR,
+                   n_workers: int = 1):
     """
     Runs Optuna, returns:
       - best fitted estimator (refit on FULL data)
       - best_params (dict) for overall best
       - study (Optuna Study)
       - best_per_model (dict mapping model -> {params, score})
+
+    n_jobs_cpcv=None splits the cores between the CPCV workers, the estimators and BLAS with the compute budget of
+    research.compute_budget.
+
+    With alpha_path, the ridge, lasso and squared loss enet trials evaluate a grid of alpha_path alphas over the
+    search range of their family instead of sampling alpha, and their params carry the best alpha of the path. The
+    trial value is out of sample: the predictions of each split come from the alpha that scores best on the other
+    splits (see out_of_split_path_predict), not from the best alpha of the grid on the same predictions.
+
+    The fold predictions of every trial are memoized in cache_dir (None disables it): repeated configurations,
+    resumed studies and other studies sharing data, features, response and splits read them instead of refitting.
+
+    With early_stopping, the hgbm trials and the huber enet trials (fitted by SGD) stop on a purged validation
+    slice at the end of each training fold instead of running max_iter iterations, per response with a list of
+    responses; the iterations of each fold are kept in the "n_iter" user attr of the trial (and in the fold
+    prediction cache), and the returned estimator runs the median of those of the best trial (see
+    EarlyStopping.for_refit).
+
+    The CPCV splits of each trial run by batches of fold_batch_size (the number of CPCV workers by default) and the
+    running correlation is reported after each batch, so that the pruner ("median" or "successive_halving", see
+    PrunerMethod) stops hopeless trials before their last split.
+
+    response_name may be a list of responses (e.g. the six position changes): every trial then fits them jointly on
+    each split, multi-output where the estimator supports it, on the rows where they are all known. The trial value
+    is their mean correlation and the per response correlations are kept in its "response_correlations" user attr.
+    The returned estimator then fits all the responses (see as_multi_output).
+
+    With a study_name (see get_study_name), the study is persisted in a journal file of storage_dir and resumed when
+    it exists: only the trials missing to reach n_trials finished trials are run, so an interrupted run continues
+    where it stopped (trials that were running when it was interrupted stay in the RUNNING state and are not
+    counted). n_workers processes then pull trials from the study concurrently, each with its share of the cores;
+    the study may end with up to n_workers - 1 trials more than n_trials.
     """
-    Xy = Xy[['tradeDate']+feature_names+[response_name]].dropna()
+    if n_workers > 1 and study_name is None:
+        raise ValueError("Several study workers need a persisted study, set study_name")
+    responses = list(response_name) if isinstance(response_name, (list, tuple)) else [response_name]
+    Xy = Xy[['tradeDate']+feature_names+responses].dropna()
     Xy.reset_index(drop=True, inplace= True)
-    study = optuna.create_study(
-        direction="maximize",
-        sampler=optuna.samplers.TPESampler(seed=seed),
-        pruner=pruners.MedianPruner(n_warmup_steps=1)
+    # shared by all the trials of the linear families
+    statistics = None
+    if len(responses) == 1:
+        statistics = SufficientStatistics.for_cv(Xy[feature_names], Xy[response_name], cv)
+    cache = FoldPredictionCache(cache_dir) if cache_dir is not None else None
+    dataset_key = hash_arrays(Xy[feature_names], Xy[response_name])
+    objective_kwargs = dict(
+        Xy=Xy,
+        feature_names=feature_names,
+        response_name=response_name,
+        cv=cv,
+        n_jobs_cpcv=n_jobs_cpcv,
+        statistics=statistics,
+        alpha_path=alpha_path,
+        cache=cache,
+        dataset_key=dataset_key,
+        early_stopping=early_stopping,
+        fold_batch_size=fold_batch_size
     )
 
-    study.optimize(
-        lambda t: objective(
-            t, Xy, feature_names, response_name, cv,
-            n_jobs_cpcv=n_jobs_cpcv 
-        ),
-        n_trials=n_trials,
-        show_progress_bar=True
-    )
+    if n_workers > 1:
+        # created once here, the workers load it
+        study = optuna.create_study(study_name=study_name, storage=get_study_storage(study_name, storage_dir),
+                                    load_if_exists=True, direction="maximize")
+        if len(study.get_trials(deepcopy=False, states=FINISHED_STATES)) < n_trials:
+            n_cores = get_compute_budget(n_tasks=n_workers, outer_jobs=n_workers).inner_jobs
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                workers = [executor.submit(_optimize, study_name, storage_dir, n_trials, seed + worker, pruner,
+                                           n_cores, False, objective_kwargs)
+                           for worker in range(n_workers)]
+                for worker in workers:
+                    worker.result()
+        study = optuna.load_study(study_name=study_name, storage=get_study_storage(study_name, storage_dir))
+    else:
+        study = _optimize(study_name, storage_dir, n_trials, seed, pruner, None, True, objective_kwargs)
 
     # ---- find best trial per model family ----
     best_per_model = {}
@@ -173,12 +472,18 @@ def find_best_model(Xy: pd.DataFrame,
         # Keep only the best score (lower is better)
         if model_type not in best_per_model or score < best_per_model[model_type]["score"]:
             best_per_model[model_type] = {
-                "params": trial.params,
+                "params": _trial_params(trial),
                 "score": score
             }
 
     # ---- rebuild overall best estimator ----
-    best_params = study.best_trial.params
+    best_params = _trial_params(study.best_trial)
     best_estimator = build_estimator_from_trial(optuna.trial.FixedTrial(best_params))
+    if len(responses) > 1:
+        # the responses are fitted jointly, as in the trials
+        best_estimator = as_multi_output(best_estimator)
+    if early_stopping is not None:
+        # refit for as many iterations as the scored folds ran
+        best_estimator = early_stopping.for_refit(best_estimator, study.best_trial.user_attrs.get("n_iter"))
 
     return best_estimator, best_params, study, best_per_model
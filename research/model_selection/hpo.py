@@ -9,6 +9,7 @@ from skopt.space import Real, Integer
 from sklearn.model_selection import cross_val_predict
 
 
+from research.compute_budget import get_compute_budget
 from research.model_selection.PurgedKFold import PurgedKFold
 
 
@@ -31,25 +32,30 @@ def run_hpo(dataset: pd.DataFrame,
         n_purge=10,
 
     )
-    opt = BayesSearchCV(model,
+    # n_points candidates evaluated on every fold at once
+    budget = get_compute_budget(n_tasks=4 * cv.get_n_splits())
+    opt = BayesSearchCV(budget.configure(model),
                         parameter_space,
                         n_iter=10,
-                        n_jobs=10,
+                        n_jobs=budget.outer_jobs,
                         n_points=4,
                         iid=False,
                         cv=cv,
                         verbose=1
                         )
-    opt.fit(X=Xy[features], y=Xy[target])
+    with budget.limits():
+        opt.fit(X=Xy[features], y=Xy[target])
     print(f"{target} best parameters: {opt.best_params_} ")
 
-    yhat = cross_val_predict(estimator=opt.best_estimator_,
-                             X=Xy[features],
-                             y=Xy[target],
-                             method = 'predict',
-                             cv = cv,
-                             n_jobs=8,
-                             verbose = 0 )
+    budget = get_compute_budget(n_tasks=cv.get_n_splits())
+    with budget.limits():
+        yhat = cross_val_predict(estimator=budget.configure(opt.best_estimator_),
+                                 X=Xy[features],
+                                 y=Xy[target],
+                                 method = 'predict',
+                                 cv = cv,
+                                 n_jobs=budget.outer_jobs,
+                                 verbose = 0 )
 
     optimal_predicted_actual_correlation = pd.DataFrame(
         {'y': Xy[target],
@@ -0,0 +1,323 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import enet_path
+from sklearn.model_selection._split import BaseCrossValidator
+
+from research.model_selection.CombinatorialPurgedCV import CombinatorialPurgedCV, _partition_labels
+from research.model_selection.prediction_cache import FoldPredictionCache
+
+
+LINEAR_MODELS = ("ols", "ridge", "lasso", "enet")
+PATH_MODELS = ("ridge", "lasso", "enet")
+
+
+class SufficientStatistics():
+    """Per block sufficient statistics of a linear regression, summed into the statistics of any train set
+
+    The rows are cut into contiguous blocks (the CPCV partitions) and, for each block, the count, the sums of X and
+    y and the cross products XᵀX, Xᵀy, yᵀy are computed once. The statistics of a train set are the sum of the blocks it
+    touches minus the few rows of those blocks it leaves out (purged or embargoed rows), so their cost does not
+    depend on the size of the train set.
+
+    X and y are stored shifted by their full sample means, which keeps the cross products well conditioned for
+    levels such as open interest; the shift cancels out in the standardized system.
+    """
+
+    def __init__(self,
+                 X: Union[pd.DataFrame, np.ndarray],
+                 y: Union[pd.Series, np.ndarray],
+                 n_blocks: int):
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64).ravel()
+        self.shift_x = X.mean(axis=0)
+        self.shift_y = y.mean()
+        self.X = np.ascontiguousarray(X - self.shift_x)
+        self.y = np.ascontiguousarray(y - self.shift_y)
+        self.n_samples = len(self.X)
+        self.labels = _partition_labels(self.n_samples, n_blocks)
+        self.n_blocks = n_blocks
+        self.blocks = [self._statistics(np.flatnonzero(self.labels == b)) for b in range(n_blocks)]
+
+    @classmethod
+    def for_cv(cls,
+               X: Union[pd.DataFrame, np.ndarray],
+               y: Union[pd.Series, np.ndarray],
+               cv: BaseCrossValidator) -> "SufficientStatistics":
+        """Statistics blocked on the partitions of a CombinatorialPurgedCV, or on 32 blocks for other splitters"""
+        return cls(X, y, n_blocks=cv.n_partitions if isinstance(cv, CombinatorialPurgedCV) else 32)
+
+    def _statistics(self, rows: np.ndarray) -> tuple:
+        X, y = self.X[rows], self.y[rows]
+        return len(rows), X.sum(axis=0), y.sum(), X.T @ X, X.T @ y, y @ y
+
+    def train_statistics(self, train: np.ndarray) -> tuple:
+        """Count, sum of X, sum of y, XᵀX, Xᵀy and yᵀy of the train rows"""
+        mask = np.zeros(self.n_samples, dtype=bool)
+        mask[train] = True
+        touched = np.bincount(self.labels[train], minlength=self.n_blocks) > 0
+        statistics = [sum(parts) for parts in zip(*[self.blocks[b] for b in np.flatnonzero(touched)])]
+        left_out = np.flatnonzero(touched[self.labels] & ~mask)
+        if len(left_out):
+            statistics = [total - part for total, part in zip(statistics, self._statistics(left_out))]
+        return tuple(statistics)
+
+
+def standardized_system(statistics: tuple) -> tuple:
+    """Centered and scaled Gram matrix and moment vector of a train set, as a StandardScaler + linear model sees it
+
+    Returns:
+        G (XᵀX/n of the standardized X), g (Xᵀy/n of the standardized X and centered y), the means and scales of X,
+        and the mean and variance of y.
+    """
+    n, sum_x, sum_y, xtx, xty, yty = statistics
+    mean_x, mean_y = sum_x / n, sum_y / n
+    variance_y = max(yty / n - mean_y ** 2, 0.0)
+    covariance = xtx / n - np.outer(mean_x, mean_x)
+    cross = xty / n - mean_x * mean_y
+    scale = np.sqrt(np.clip(np.diag(covariance), 0.0, None))
+    scale[scale < 10 * np.finfo(np.float64).eps] = 1.0  # constant features, as in StandardScaler
+    G = covariance / np.outer(scale, scale)
+    g = cross / scale
+    return G, g, mean_x, scale, mean_y, variance_y
+
+
+def elastic_net_path(G: np.ndarray,
+                     g: np.ndarray,
+                     variance_y: float,
+                     l1_ratio: float,
+                     alphas: np.ndarray,
+                     max_iter: int = 1000,
+                     tol: float = 1e-4) -> np.ndarray:
+    """ElasticNet(alpha, l1_ratio) coefficients (Lasso when l1_ratio = 1) of every alpha, from the Gram matrix
+
+    The objective ½βᵀGβ - gᵀβ + ½var(y) + α·l1_ratio‖β‖₁ + ½α(1 - l1_ratio)‖β‖² only depends on the second moments
+    of the standardized X and centered y, so it is the least squares objective of p + 1 surrogate rows with the same
+    moments, the square root of [[G, g], [gᵀ, var(y)]]. sklearn's enet_path solves it on those rows with the
+    duality gap stopping rule, max_iter and tol of Lasso and ElasticNet, warm-starting each alpha from the previous
+    one, so each sweep costs O(p²) whatever the number of rows.
+
+    Returns:
+        np.ndarray: (n_alphas, n_features) coefficients, in the order of alphas.
+    """
+    p = len(g)
+    moments = np.empty((p + 1, p + 1))
+    moments[:p, :p], moments[:p, p], moments[p, :p], moments[p, p] = G, g, g, variance_y
+    eigenvalues, eigenvectors = np.linalg.eigh(moments)
+    # (p + 1) rows whose mean cross products are the moments
+    rows = np.sqrt((p + 1) * np.clip(eigenvalues, 0.0, None))[:, None] * eigenvectors.T
+    alphas = np.asarray(alphas, dtype=float)
+    order = np.argsort(-alphas)
+    _, coefs, _ = enet_path(rows[:, :p], rows[:, p], l1_ratio=l1_ratio, alphas=alphas[order],
+                            max_iter=max_iter, tol=tol)
+    betas = np.empty((len(alphas), p))
+    betas[order] = coefs.T
+    return betas
+
+
+def supports(model_name: str, params: dict) -> bool:
+    """Whether the sufficient statistics path reproduces the pipeline of build_estimator_from_trial"""
+    if model_name not in LINEAR_MODELS:
+        return False
+    # the huber loss of SGDRegressor has no closed form in the sufficient statistics
+    return not (model_name == "enet" and params.get("loss", "squared_error") != "squared_error")
+
+
+def solve(model_name: str,
+          params: dict,
+          G: np.ndarray,
+          g: np.ndarray,
+          n_train: int,
+          variance_y: float) -> np.ndarray:
+    """Coefficients on the standardized features of a linear family of build_estimator_from_trial
+
+    ols and ridge are solved exactly; lasso and enet (the ElasticNet of a squared error loss) by the coordinate
+    descent of sklearn, see elastic_net_path.
+    """
+    if model_name == "ols":
+        return np.linalg.lstsq(G, g, rcond=None)[0]
+    alpha = params["alpha"]
+    if model_name == "ridge":
+        # Ridge penalizes the sum of squares, not the mean: (XᵀX + αI)β = Xᵀy, here divided by n
+        return np.linalg.solve(G + alpha * np.eye(len(g)) / n_train, g)
+    if model_name in ("lasso", "enet"):
+        return solve_path(model_name, params, G, g, n_train, variance_y, alphas=[alpha])[0]
+    raise ValueError(f"{model_name} is not a linear model family")
+
+
+def linear_cpcv_predict(model_name: str,
+                        params: dict,
+                        X: Union[pd.DataFrame, np.ndarray],
+                        y: Union[pd.Series, np.ndarray],
+                        cv: BaseCrossValidator,
+                        statistics: SufficientStatistics = None,
+                        return_split_predictions: bool = False,
+                        cache: FoldPredictionCache = None,
+                        cache_key: str = None) -> pd.Series:
+    """cpcv_predict for the linear families of build_estimator_from_trial, from sufficient statistics
+
+    Each split solves a p x p system assembled from the block statistics instead of refitting the scaler and the
+    model on its train rows; the output has the format of cpcv_predict(method="predict").
+
+    Args:
+        model_name: one of LINEAR_MODELS, see supports.
+        params: trial parameters (alpha, l1_ratio, ...).
+        X: features.
+        y: response.
+        cv: cross-validator, CombinatorialPurgedCV blocks are its partitions.
+        statistics: precomputed statistics of (X, y), to share them between trials.
+        return_split_predictions: also return the per split predictions, see get_backtest_paths.
+        cache, cache_key: fold prediction cache, see cpcv_predict.
+    """
+    if statistics is None:
+        statistics = SufficientStatistics.for_cv(X, y, cv)
+    split_predictions = []
+    for train, test in cv.split(X):
+        yhat = cache.load(cache_key, train, test) if cache is not None else None
+        if yhat is None:
+            train_statistics = statistics.train_statistics(train)
+            G, g, mean_x, scale, mean_y, variance_y = standardized_system(train_statistics)
+            beta = solve(model_name, params, G, g, n_train=train_statistics[0], variance_y=variance_y)
+            yhat = statistics.shift_y + mean_y + ((statistics.X[test] - mean_x) / scale) @ beta
+            if cache is not None:
+                cache.save(cache_key, train, test, yhat)
+        split_predictions.append(pd.DataFrame({"yhat": yhat, "index": test}))
+    predictions = pd.concat(split_predictions).groupby("index").mean().reset_index()["yhat"]
+    if return_split_predictions:
+        return predictions, split_predictions
+    return predictions
+
+
+def solve_path(model_name: str,
+               params: dict,
+               G: np.ndarray,
+               g: np.ndarray,
+               n_train: int,
+               variance_y: float,
+               alphas: np.ndarray) -> np.ndarray:
+    """Coefficients for every alpha of a grid, see solve
+
+    ridge reuses one eigendecomposition of the Gram matrix (the SVD of the standardized X) for all alphas; lasso and
+    enet run one warm-started elastic_net_path from the largest alpha down.
+
+    Returns:
+        np.ndarray: (n_alphas, n_features) coefficients, in the order of alphas.
+    """
+    alphas = np.asarray(alphas, dtype=float)
+    if model_name == "ridge":
+        eigenvalues, eigenvectors = np.linalg.eigh(G)
+        projected = eigenvectors.T @ g
+        shrinkage = 1.0 / (eigenvalues[None, :] + alphas[:, None] / n_train)
+        return (shrinkage * projected[None, :]) @ eigenvectors.T
+    if model_name not in ("lasso", "enet"):
+        raise ValueError(f"{model_name} has no regularization path")
+    l1_ratio = 1.0 if model_name == "lasso" else params.get("l1_ratio", 0.5)
+    return elastic_net_path(G, g, variance_y, l1_ratio=l1_ratio, alphas=alphas)
+
+
+def linear_cpcv_path_predict(model_name: str,
+                             params: dict,
+                             alphas: np.ndarray,
+                             X: Union[pd.DataFrame, np.ndarray],
+                             y: Union[pd.Series, np.ndarray],
+                             cv: BaseCrossValidator,
+                             statistics: SufficientStatistics = None,
+                             return_split_predictions: bool = False,
+                             cache: FoldPredictionCache = None,
+                             cache_key: str = None) -> np.ndarray:
+    """Averaged out-of-sample predictions of every alpha of a grid, in one pass over the splits
+
+    Args:
+        model_name: one of PATH_MODELS.
+        params: trial parameters other than alpha (l1_ratio, ...).
+        alphas: regularization grid.
+        X, y, cv, statistics: see linear_cpcv_predict.
+        return_split_predictions: also return, per split, the test indices and the (n_alphas, n_test) predictions.
+        cache, cache_key: fold prediction cache, see cpcv_predict. The key must identify the alphas.
+
+    Returns:
+        np.ndarray: (n_alphas, n_samples) predictions averaged over the splits, NaN for indices never tested.
+    """
+    if statistics is None:
+        statistics = SufficientStatistics.for_cv(X, y, cv)
+    alphas = np.asarray(alphas, dtype=float)
+    totals = np.zeros((len(alphas), statistics.n_samples))
+    counts = np.zeros(statistics.n_samples)
+    split_predictions = []
+    for train, test in cv.split(X):
+        yhat = cache.load(cache_key, train, test) if cache is not None else None
+        if yhat is None:
+            train_statistics = statistics.train_statistics(train)
+            G, g, mean_x, scale, mean_y, variance_y = standardized_system(train_statistics)
+            betas = solve_path(model_name, params, G, g, n_train=train_statistics[0], variance_y=variance_y,
+                               alphas=alphas)
+            yhat = statistics.shift_y + mean_y + betas @ ((statistics.X[test] - mean_x) / scale).T
+            if cache is not None:
+                cache.save(cache_key, train, test, yhat)
+        np.add.at(totals, (slice(None), test), yhat)
+        np.add.at(counts, test, 1)
+        split_predictions.append((test, yhat))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        predictions = totals / counts
+    if return_split_predictions:
+        return predictions, split_predictions
+    return predictions
+
+
+def path_correlations(predictions: np.ndarray, y: Union[pd.Series, np.ndarray]) -> np.ndarray:
+    """Correlation between y and the predictions of each alpha, over the indices where both are finite"""
+    y = np.asarray(y, dtype=float)
+    correlations = np.full(len(predictions), np.nan)
+    for i, yhat in enumerate(predictions):
+        mask = np.isfinite(yhat) & np.isfinite(y)
+        if mask.sum() > 1 and np.std(yhat[mask]) > 0:
+            correlations[i] = np.corrcoef(y[mask], yhat[mask])[0, 1]
+    return correlations
+
+
+def out_of_split_path_predict(split_predictions: list,
+                              y: Union[pd.Series, np.ndarray],
+                              n_samples: int) -> tuple:
+    """Predictions of an alpha path with the alpha of each split chosen on the other splits
+
+    The best alpha of the averaged path is chosen on the predictions it is scored on, which flatters the path
+    families against those scored at a single configuration. Here the test predictions of each split come from the
+    alpha with the highest pooled correlation over the test rows of all the other splits, so that the score of the
+    path stays out of sample.
+
+    Args:
+        split_predictions: per split, the test indices and the (n_alphas, n_test) predictions, see
+            linear_cpcv_path_predict.
+        y: response.
+        n_samples: number of rows of X.
+
+    Returns:
+        tuple: predictions averaged over the splits (NaN for indices never tested), per split predictions in the
+        format of linear_cpcv_predict and the position of the alpha chosen for each split.
+    """
+    y = np.asarray(y, dtype=float)
+    # pooled moments n, Σy, Σŷ, Σy², Σŷ², Σyŷ of each alpha on each split
+    moments = []
+    for test, yhat in split_predictions:
+        mask = np.isfinite(yhat) & np.isfinite(y[test])[None, :]
+        y_test = np.where(mask, y[test][None, :], 0.0)
+        yhat = np.where(mask, yhat, 0.0)
+        moments.append(np.stack([mask.sum(axis=1), y_test.sum(axis=1), yhat.sum(axis=1), (y_test ** 2).sum(axis=1),
+                                 (yhat ** 2).sum(axis=1), (y_test * yhat).sum(axis=1)], axis=1))
+    moments = np.asarray(moments)
+    n, sy, sp, syy, spp, syp = np.moveaxis(moments.sum(axis=0)[None] - moments, 2, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        correlations = (n * syp - sy * sp) / np.sqrt((n * syy - sy ** 2) * (n * spp - sp ** 2))
+    selected = np.argmax(np.where(np.isfinite(correlations), correlations, -np.inf), axis=1)
+
+    totals = np.zeros(n_samples)
+    counts = np.zeros(n_samples)
+    selected_predictions = []
+    for (test, yhat), best in zip(split_predictions, selected):
+        np.add.at(totals, test, yhat[best])
+        np.add.at(counts, test, 1)
+        selected_predictions.append(pd.DataFrame({"yhat": yhat[best], "index": test}))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        predictions = totals / counts
+    return predictions, selected_predictions, selected
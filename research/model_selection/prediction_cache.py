@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.base import BaseEstimator
+
+
+FOLD_PREDICTION_CACHE_DIR = Path(__file__).resolve().parents[2] / "cache" / "fold_predictions"
+# parameters that do not change the predictions
+IGNORED_PARAMS = ("n_jobs", "verbose", "memory", "copy_X")
+
+
+def hash_arrays(*arrays: Union[np.ndarray, pd.DataFrame, pd.Series]) -> str:
+    """Content hash of arrays, their dtypes and shapes included"""
+    digest = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array.to_numpy() if isinstance(array, (pd.DataFrame, pd.Series)) else array)
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def canonical_params(estimator: BaseEstimator, exclude: tuple = (), significant_digits: int = 6) -> dict:
+    """Estimator class and parameters (pipeline steps included) as plain values, the key of its predictions
+
+    Nested estimators are replaced by their class name, the IGNORED_PARAMS and exclude are dropped and floats are
+    rounded to significant_digits, so that configurations TPE proposes again up to rounding share their folds.
+    """
+    params = {"estimator": type(estimator).__name__}
+    for name, value in estimator.get_params(deep=True).items():
+        if name.split("__")[-1] in IGNORED_PARAMS + tuple(exclude):
+            continue
+        if isinstance(value, BaseEstimator):
+            value = type(value).__name__
+        elif isinstance(value, (float, np.floating)):
+            value = float(f"{value:.{significant_digits}g}")
+        elif isinstance(value, (list, tuple)):
+            # Pipeline steps, already described by their own parameters
+            continue
+        params[name] = value
+    return params
+
+
+class FoldPredictionCache():
+    """On-disk cache of the test predictions of every CV split
+
+    A configuration key (see key) identifies the data, features, response and model; a split is identified by the
+    hash of its train and test indices, so that studies and responses sharing a configuration and a split share
+    its predictions, whichever cross-validator produced the split. Files are written then renamed, so concurrent
+    workers never read a partial file. The iterations an early stopped estimator ran on a split are kept next to its
+    predictions.
+
+    Examples
+    --------
+    >>> cache = FoldPredictionCache()
+    >>> key = cache.key(dataset=hash_arrays(X, y), features=features, response=response,
+    ...                 params=canonical_params(estimator))
+    >>> cpcv_predict(estimator, X, y, cv=cv, cache=cache, cache_key=key)
+    """
+
+    def __init__(self, directory: Union[str, Path] = FOLD_PREDICTION_CACHE_DIR):
+        self.directory = Path(directory)
+
+    @staticmethod
+    def key(**parts) -> str:
+        """Configuration key, a hash of the JSON of parts and of the scikit-learn version"""
+        parts = dict(parts, sklearn=sklearn.__version__)
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _path(self, key: str, train: np.ndarray, test: np.ndarray) -> Path:
+        split = hash_arrays(np.asarray(train, dtype=np.int64), np.asarray(test, dtype=np.int64))
+        return self.directory / key / f"{split}.npy"
+
+    def load(self, key: str, train: np.ndarray, test: np.ndarray) -> Union[np.ndarray, None]:
+        """Cached test predictions of a split, None on a miss"""
+        path = self._path(key, train, test)
+        if not path.exists():
+            return None
+        return np.load(path)
+
+    def load_n_iter(self, key: str, train: np.ndarray, test: np.ndarray) -> Union[int, None]:
+        """Iterations the estimator of a cached split stopped at, None when it was not stopped early"""
+        path = self._path(key, train, test).with_suffix(".n_iter.json")
+        if not path.exists():
+            return None
+        return int(json.loads(path.read_text()))
+
+    @staticmethod
+    def _write(path: Path, write) -> None:
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    def save(self, key: str, train: np.ndarray, test: np.ndarray, predictions: np.ndarray,
+             n_iter: int = None) -> None:
+        """Stores the test predictions of a split, and the iterations its estimator stopped at when given"""
+        path = self._path(key, train, test)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if n_iter is not None:
+            # written first, so that a split read from the cache has its iterations
+            self._write(path.with_suffix(".n_iter.json"), lambda f: f.write(json.dumps(int(n_iter)).encode()))
+        self._write(path, lambda f: np.save(f, np.asarray(predictions)))
@@ -1,6 +1,6 @@
 
+import numpy as np
 import pandas as pd
-from scipy.stats.mstats import winsorize
 from sklearn.base import BaseEstimator, TransformerMixin
 from enum import Enum
 
@@ -28,17 +28,48 @@ class FutureTicker(Enum):
 
 
 class Winsorizer(BaseEstimator, TransformerMixin):
+    """Clips each column to the quantiles learned on the data passed to fit.
+
+    Parameters
+    ----------
+    limits : tuple of float, default=(0.05, 0.05)
+        Fraction of observations clipped at the lower and upper end of each column.
+        None on either side disables clipping on that side.
+
+    Attributes
+    ----------
+    lower_ : np.ndarray
+        Lower clip bound of each column.
+    upper_ : np.ndarray
+        Upper clip bound of each column.
+    """
     def __init__(self, limits=(0.05, 0.05)):
         self.limits = limits
 
     def fit(self, X, y=None):
+        values = np.asarray(X, dtype=float)
+        if values.ndim == 1:
+            values = values.reshape(-1, 1)
+        lower_limit, upper_limit = self.limits
+        n_columns = values.shape[1]
+        if lower_limit:
+            self.lower_ = np.nanquantile(values, lower_limit, axis=0)
+        else:
+            self.lower_ = np.full(n_columns, -np.inf)
+        if upper_limit:
+            self.upper_ = np.nanquantile(values, 1 - upper_limit, axis=0)
+        else:
+            self.upper_ = np.full(n_columns, np.inf)
         return self
 
     def transform(self, X, y=None):
-        X = X.copy()
-        if isinstance(X, pd.DataFrame):
-            for column in X.columns:
-                X[column] = winsorize(X[column], limits=self.limits)
+        values = np.asarray(X, dtype=float)
+        if values.ndim == 1:
+            clipped = np.clip(values, self.lower_[0], self.upper_[0])
         else:
-            X = winsorize(X, limits=self.limits)
-        return X
+            clipped = np.clip(values, self.lower_, self.upper_)
+        if isinstance(X, pd.DataFrame):
+            return pd.DataFrame(clipped, index=X.index, columns=X.columns)
+        if isinstance(X, pd.Series):
+            return pd.Series(clipped, index=X.index, name=X.name)
+        return clipped
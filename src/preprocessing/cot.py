@@ -1,23 +1,28 @@
 
 import pandas as pd
 
+from src.preprocessing.targets import build_targets
+
 class COTPanel():
 
-    def __init__(self) -> None:
+    def __init__(self, horizons: tuple = (1,)) -> None:
+        self.horizons = tuple(horizons)
         self.panel = None
     def fit(self, dataset: pd.DataFrame) -> None:
         dataset['tradeDate'] = pd.to_datetime(dataset['tradeDate'])
         dataset.sort_values(by = 'tradeDate', ascending = True, inplace = True)
-        for feature_name in ['Commercial_NetPosition', 
-                            'CommercialLongPosition', 
-                            'CommercialShortPosition',
-                            'ManagedMoney_NetPosition',
-                            'ManagedMoney_LongPosition', 
-                            'ManagedMoney_ShortPosition']:
+        positions = ['Commercial_NetPosition', 
+                     'CommercialLongPosition', 
+                     'CommercialShortPosition',
+                     'ManagedMoney_NetPosition',
+                     'ManagedMoney_LongPosition', 
+                     'ManagedMoney_ShortPosition']
+        for feature_name in positions:
             dataset[f'{feature_name}_change'] = dataset[feature_name]- dataset[feature_name].shift(1)
             dataset[f'prior_report_{feature_name}_change'] = dataset[f'{feature_name}_change'].shift(1)
-            dataset[f'forward_report_{feature_name}_change'] = dataset[f'{feature_name}_change'].shift(-1)
-            
+        # forward changes of every position over every horizon, in one pass
+        targets = build_targets(dataset, positions=positions, horizons=self.horizons, scaled=False)
+        dataset[targets.columns] = targets
             
         self.panel = dataset
 
@@ -1,84 +1,149 @@
 
 import pandas as pd
 
+from src.preprocessing.feature_computer import compute_features
+from src.preprocessing.feature_registry import DATASET_FEATURES, POSITIONS, FeatureRegistry, is_lagged, is_target
+from src.preprocessing.targets import build_targets, target_name
+from src.utils.memory import cast_floats, check_precision, get_memory_report, validate_float_dtype
+
 
 class DataSetBuilder:
 
-    def __init__(self) -> None:
+    SYNTHETIC_SPREAD_COLUMNS = ['F1_RolledPrice',
+                                'F2_RolledPrice',
+                                'F3_RolledPrice',
+                                'F1_RolledPrice_rolling_20D_volatility',
+                                'F2_RolledPrice_rolling_20D_volatility',
+                                'F3_RolledPrice_rolling_20D_volatility',
+                                'SyntheticF1MinusF2_RolledPrice']
+    VOLUME_COLUMNS = ['prior_cumulative_5D_F1_Volume',
+                      'prior_cumulative_5D_F2_Volume']
+    OPENINTEREST_COLUMNS = ['F1_OI',
+                            'F2_OI',
+                            'F3_OI',
+                            'AGG_OI',
+                            'prior_5D_F1_OI_change',
+                            'prior_5D_F2_OI_change',
+                            'prior_5D_AGG_OI_change']
+
+    def __init__(self,
+                 dtype: str = 'float64',
+                 precision_check_features: list[str] = None,
+                 precision_tolerance: float = 1e-4,
+                 registry: FeatureRegistry = DATASET_FEATURES,
+                 horizons: tuple = (1,)) -> None:
+        self.dtype = validate_float_dtype(dtype)
+        self.precision_check_features = precision_check_features
+        self.precision_tolerance = precision_tolerance
+        self.registry = registry
+        self.horizons = tuple(horizons)
         self.data = pd.DataFrame()
+        self.precision = None
+        self.memory_report = None
+
+    @classmethod
+    def column_order(cls) -> list[str]:
+        """ Column order of the full build, that of the historical datasets; other columns (longer horizon targets)
+        follow it """
+        scaled = [f'{position}_to_openinterest' for position in POSITIONS]
+        columns = ['tradeDate', 'Name'] + POSITIONS
+        for position in POSITIONS:
+            columns += [f'{position}_change', f'prior_report_{position}_change', target_name(position)]
+        columns += cls.SYNTHETIC_SPREAD_COLUMNS + ['prior_report_SyntheticF1MinusF2_RolledPrice_change']
+        columns += cls.VOLUME_COLUMNS + ['prior_cumulative_5D_F1MinusF2_Volume']
+        columns += cls.OPENINTEREST_COLUMNS + ['prior_5D_F1MinusF2_openinterest_change']
+        columns += scaled
+        for position, name in zip(POSITIONS, scaled):
+            columns += [f'{name}_change', f'prior_report_{name}_change', target_name(position, scaled=True)]
+        for name in ['prior_cumulative_5D_F1_Volume',
+                     'prior_cumulative_5D_F2_Volume',
+                     'prior_cumulative_5D_F1MinusF2_Volume',
+                     'F1_RolledPrice',
+                     'F2_RolledPrice',
+                     'F3_RolledPrice']:
+            columns += [f'{name}_change', f'next_{name}_change']
+        return columns
+
+    @staticmethod
+    def _merge(dataset: pd.DataFrame, source_db: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+        """ Left merges the requested columns of a daily source on the report dates """
+        columns = [c for c in columns if c in source_db.columns and c not in dataset.columns]
+        if not columns:
+            return dataset
+        source_db = source_db[['tradeDate'] + columns].copy()
+        source_db['tradeDate'] = pd.to_datetime(source_db['tradeDate']).dt.date
+        return pd.merge(dataset, source_db, on='tradeDate', how='left')
 
     def fit(self,
             cot_db: pd.DataFrame,
             synthetic_spread_db: pd.DataFrame,
             volume_db: pd.DataFrame,
             openinterest_db: pd.DataFrame,
+            features: list[str] = None,
             ) -> None:
+        """
+        Builds the report-level dataset.
 
+        Args:
+            cot_db: COT panel, one row per report.
+            synthetic_spread_db: daily prices with the synthetic spread hedge ratios.
+            volume_db: daily volume panel.
+            openinterest_db: daily open interest panel.
+            features: features (and responses) to build. Only those and their dependencies are merged and
+                computed, and data holds tradeDate plus these columns. When None, every registered feature but
+                the lagged inputs and the forward targets is built on top of all the merged columns, and the
+                forward targets of every position over self.horizons are added in one pass.
+        """
         cot_db['tradeDate'] = pd.to_datetime(cot_db['tradeDate']).dt.date
-        synthetic_spread_db['SyntheticF1MinusF2_RolledPrice'] = (synthetic_spread_db['F1_RolledPrice'] - 
-                            synthetic_spread_db['beta_ols_10'] * synthetic_spread_db['F2_RolledPrice']
-                                )
-        synthetic_spread_db['tradeDate'] = pd.to_datetime(synthetic_spread_db['tradeDate']).dt.date
-        dataset = pd.merge(cot_db,
-                            synthetic_spread_db[['tradeDate', 
-                                                'F1_RolledPrice',
-                                                'F2_RolledPrice',
-                                                'F3_RolledPrice',
-                                                'F1_RolledPrice_rolling_20D_volatility',
-                                                'F2_RolledPrice_rolling_20D_volatility',
-                                                'F3_RolledPrice_rolling_20D_volatility',
-                                                'SyntheticF1MinusF2_RolledPrice']],
-                            on = 'tradeDate',
-                            how = 'left') 
-        dataset[f'prior_report_SyntheticF1MinusF2_RolledPrice_change'] = (dataset['SyntheticF1MinusF2_RolledPrice']-
-                                                                  dataset['SyntheticF1MinusF2_RolledPrice'].shift(1) )
-        volume_db['tradeDate'] = pd.to_datetime(volume_db['tradeDate']).dt.date
-        dataset = pd.merge(dataset, 
-                            volume_db[[  'tradeDate', 
-                                            'prior_cumulative_5D_F1_Volume',
-                                            'prior_cumulative_5D_F2_Volume' ]],
-                            on = 'tradeDate',
-                            how = 'left')
-        dataset['prior_cumulative_5D_F1MinusF2_Volume'] = dataset['prior_cumulative_5D_F1_Volume']-dataset['prior_cumulative_5D_F2_Volume']
-        openinterest_db['tradeDate'] = pd.to_datetime(openinterest_db['tradeDate']).dt.date
-        dataset = pd.merge(dataset, 
-                            openinterest_db[['tradeDate',
-                                                    'F1_OI',
-                                                    'F2_OI',
-                                                    'F3_OI',
-                                                    'AGG_OI',
-                                                    'prior_5D_F1_OI_change',
-                                                    'prior_5D_F2_OI_change',
-                                                    'prior_5D_AGG_OI_change'
-                                                ]],
-                                            on = 'tradeDate',
-                                            how = 'left')
-        dataset['prior_5D_F1MinusF2_openinterest_change'] = dataset['prior_5D_F1_OI_change']-dataset['prior_5D_F2_OI_change']
-        for f in  ['Commercial_NetPosition',
-                    'CommercialLongPosition',
-                    'CommercialShortPosition',
-                    'ManagedMoney_NetPosition',
-                    'ManagedMoney_LongPosition',
-                    'ManagedMoney_ShortPosition']:
-            dataset[f'{f}_to_openinterest'] = dataset[f]/dataset['AGG_OI'] 
-        dataset.sort_values(by = 'tradeDate', ascending = True, inplace = True)
-        for feature_name in ['Commercial_NetPosition_to_openinterest',
-                            'CommercialLongPosition_to_openinterest',
-                            'CommercialShortPosition_to_openinterest',
-                            'ManagedMoney_NetPosition_to_openinterest',
-                            'ManagedMoney_LongPosition_to_openinterest',
-                            'ManagedMoney_ShortPosition_to_openinterest']:
-            dataset[f'{feature_name}_change'] = dataset[feature_name]- dataset[feature_name].shift(1)
-            dataset[f'prior_report_{feature_name}_change'] = dataset[f'{feature_name}_change'].shift(1)
-            dataset[f'forward_{feature_name}_change'] =  dataset[feature_name].shift(-1) - dataset[feature_name]
-        
-
-        for name in [ 'prior_cumulative_5D_F1_Volume',
-                    'prior_cumulative_5D_F2_Volume',
-                    'prior_cumulative_5D_F1MinusF2_Volume' ,
-                    'F1_RolledPrice',
-                    'F2_RolledPrice',
-                    'F3_RolledPrice']:
-            dataset[f'{name}_change'] = dataset[name] - dataset[name].shift(1)
-            dataset[f'next_{name}_change'] =  dataset[name].shift(-1) - dataset[name] 
-        self.data = dataset
+        if features is None:
+            requested = self.SYNTHETIC_SPREAD_COLUMNS + self.VOLUME_COLUMNS + self.OPENINTEREST_COLUMNS
+            requested += [name for name in self.registry.names if not is_lagged(name) and not is_target(name)]
+            requested += [p for p in POSITIONS + ['AGG_OI'] if p not in requested]
+        else:
+            requested = list(features)
+        source_dbs = [synthetic_spread_db, volume_db, openinterest_db]
+        available = set(cot_db.columns).union(*[source_db.columns for source_db in source_dbs])
+        leaves = self.registry.leaves(requested, available=available)
+
+        dataset = cot_db
+        for source_db in source_dbs:
+            dataset = self._merge(dataset, source_db, leaves)
+        # features are computed at full precision whatever the dtype of the panels, then cast at the end
+        dataset = cast_floats(dataset, 'float64')
+        dataset.sort_values(by='tradeDate', ascending=True, inplace=True)
+
+        computed = compute_features(dataset, features=requested, registry=self.registry)
+        if features is None:
+            new_columns = [c for c in computed.columns if c not in dataset.columns]
+            dataset = pd.concat([dataset, computed[new_columns]], axis=1)
+            targets = build_targets(dataset, positions=POSITIONS, horizons=self.horizons)
+            dataset = pd.concat([dataset, targets[[c for c in targets.columns if c not in dataset.columns]]], axis=1)
+            # inputs merged only to compute features (e.g. beta_ols_10) are not part of the dataset
+            dropped = [c for c in leaves if c not in requested and c not in cot_db.columns]
+            order = [c for c in self.column_order() if c in dataset.columns]
+            dataset = dataset[order + [c for c in dataset.columns if c not in order and c not in dropped]]
+        else:
+            dataset = pd.concat([dataset[['tradeDate']], computed], axis=1)
+
+        self.data = cast_floats(dataset, self.dtype)
+        self.memory_report = get_memory_report(self.data, name='dataset')
+
+    def check_precision(self, reference: pd.DataFrame) -> pd.DataFrame:
+        """
+        Checks the precision_check_features of the fitted dataset against a dataset built from float64 panels.
+
+        The reference must be fitted on the float64 version of the panels this dataset is fitted on: casting a
+        float32 panel back to float64 does not restore its precision, so only a reference built from the
+        float64 panels measures the rounding of prices, volumes and open interest.
+
+        Args:
+            reference: data of a float64 DataSetBuilder fitted on the float64 panels, aligned with self.data.
+
+        Returns:
+            pd.DataFrame: the scaled error of each feature, also stored in precision.
+        """
+        self.precision = check_precision(reference=reference,
+                                         compact=self.data,
+                                         features=self.precision_check_features,
+                                         tolerance=self.precision_tolerance)
+        return self.precision
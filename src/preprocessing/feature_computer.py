@@ -0,0 +1,71 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+from src.preprocessing.feature_registry import DATASET_FEATURES, FeatureRegistry
+
+
+MODEL_FEATURES = ['prior_report_ManagedMoney_NetPosition_change',
+                  'prior_report_ManagedMoney_LongPosition_change',
+                  'prior_report_ManagedMoney_ShortPosition_change',
+                  'prior_report_ManagedMoney_NetPosition_to_openinterest_change',
+                  'prior_report_ManagedMoney_LongPosition_to_openinterest_change',
+                  'prior_report_ManagedMoney_ShortPosition_to_openinterest_change',
+                  'prior_report_SyntheticF1MinusF2_RolledPrice_change',
+                  'prior_cumulative_5D_F1_Volume_change',
+                  'prior_cumulative_5D_F2_Volume_change',
+                  'prior_cumulative_5D_F1MinusF2_Volume_change',
+                  'prior_5D_F1_OI_change',
+                  'prior_5D_F2_OI_change',
+                  'prior_5D_AGG_OI_change',
+                  'prior_5D_F1MinusF2_openinterest_change',
+                  'F1_RolledPrice_rolling_20D_volatility',
+                  'F2_RolledPrice_rolling_20D_volatility',
+                  'F3_RolledPrice_rolling_20D_volatility',
+                  'F1_RolledPrice_change',
+                  'F2_RolledPrice_change',
+                  'F3_RolledPrice_change']
+
+
+def to_frame(raw: Union[pd.DataFrame, dict, np.ndarray], columns: list[str] = None) -> pd.DataFrame:
+    """
+    Wraps raw inputs into a DataFrame.
+
+    Args:
+        raw: a DataFrame, a dict of scalars (one row) or of arrays (one row per element), or a 2D array.
+        columns: column names of raw when it is an array.
+
+    Returns:
+        pd.DataFrame: raw inputs, one row per observation.
+    """
+    if isinstance(raw, pd.DataFrame):
+        return raw
+    if isinstance(raw, dict):
+        return pd.DataFrame({k: np.atleast_1d(np.asarray(v, dtype=float)) for k, v in raw.items()})
+    if columns is None:
+        raise ValueError("columns must be given when raw inputs are passed as an array")
+    return pd.DataFrame(np.atleast_2d(np.asarray(raw, dtype=float)), columns=columns)
+
+
+def compute_features(raw: Union[pd.DataFrame, dict, np.ndarray],
+                     features: list[str] = MODEL_FEATURES,
+                     columns: list[str] = None,
+                     registry: FeatureRegistry = DATASET_FEATURES) -> pd.DataFrame:
+    """
+    Computes a feature matrix from raw inputs.
+
+    This is the single path used to build features, whether raw holds the time ordered report series
+    (DataSetBuilder), where lagged inputs are derived by shifting, or rows that carry the lagged inputs
+    explicitly (X, X_t1, X_t2, X_5d_ago), such as a single live inference row or a what-if grid.
+
+    Args:
+        raw: raw inputs, see to_frame.
+        features: features to compute.
+        columns: column names of raw when it is an array.
+        registry: registry declaring the features.
+
+    Returns:
+        pd.DataFrame: one column per feature, indexed like raw.
+    """
+    return registry.compute(to_frame(raw, columns=columns), features)
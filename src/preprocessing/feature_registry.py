@@ -0,0 +1,238 @@
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+import pandas as pd
+
+from src.preprocessing.targets import HORIZONS, forward_change, target_name
+
+
+POSITIONS = ['Commercial_NetPosition',
+             'CommercialLongPosition',
+             'CommercialShortPosition',
+             'ManagedMoney_NetPosition',
+             'ManagedMoney_LongPosition',
+             'ManagedMoney_ShortPosition']
+
+
+@dataclass(frozen=True)
+class Feature:
+    """A named feature, the features or raw columns it is computed from and how to compute it."""
+    name: str
+    inputs: tuple
+    compute: Callable[..., pd.Series]
+
+
+class FeatureRegistry:
+    """
+    Registry of features declared with their inputs and their computation.
+
+    Features are computed on demand: asking for a list of names computes only those features and the
+    features they depend on, each one once. Any name that is already a column of the data is taken as is,
+    which is what makes raw columns the leaves of the dependency graph.
+
+    Examples
+    --------
+    >>> registry = FeatureRegistry()
+    >>> registry.register('F1_RolledPrice_change', ['F1_RolledPrice'], lambda p: p - p.shift(1))
+    >>> features = registry.compute(dataset, ['F1_RolledPrice_change'])
+    """
+
+    def __init__(self) -> None:
+        self._features = {}
+
+    def register(self, name: str, inputs: Iterable[str], compute: Callable[..., pd.Series]) -> None:
+        """ Registers a feature computed by calling compute on the series of its inputs, in order """
+        if name in self._features:
+            raise ValueError(f"Feature {name} is already registered")
+        self._features[name] = Feature(name=name, inputs=tuple(inputs), compute=compute)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._features
+
+    def __getitem__(self, name: str) -> Feature:
+        return self._features[name]
+
+    @property
+    def names(self) -> list[str]:
+        """ Names of all registered features, in registration order """
+        return list(self._features.keys())
+
+    def resolve(self, names: Iterable[str], available: Iterable[str] = ()) -> list[str]:
+        """
+        Lists the registered features needed to compute names, dependencies first.
+
+        Args:
+            names: features requested.
+            available: names already available as columns, which are not computed nor expanded.
+
+        Returns:
+            list[str]: registered features to compute, in an order where inputs come before their users.
+        """
+        available = set(available)
+        ordered = []
+        visited = set()
+        in_progress = set()
+
+        def _visit(name: str) -> None:
+            if name in visited or name in available or name not in self._features:
+                return
+            if name in in_progress:
+                raise ValueError(f"Circular dependency detected on feature {name}")
+            in_progress.add(name)
+            for input_name in self._features[name].inputs:
+                _visit(input_name)
+            in_progress.discard(name)
+            visited.add(name)
+            ordered.append(name)
+
+        for name in names:
+            _visit(name)
+        return ordered
+
+    def leaves(self, names: Iterable[str], available: Iterable[str] = ()) -> list[str]:
+        """ Lists the raw columns, or available names, that names ultimately depend on """
+        names = list(names)
+        available = set(available)
+        to_compute = self.resolve(names, available)
+        leaves = []
+        candidates = [n for n in names if n not in to_compute]
+        candidates += [i for n in to_compute for i in self._features[n].inputs]
+        for name in candidates:
+            if name not in to_compute and name not in leaves:
+                leaves.append(name)
+        return leaves
+
+    def compute(self, data: pd.DataFrame, names: Iterable[str]) -> pd.DataFrame:
+        """
+        Computes the requested features from the columns of data.
+
+        Args:
+            data: DataFrame holding the raw inputs, sorted as the features expect (e.g. by trade date).
+            names: features to compute.
+
+        Returns:
+            pd.DataFrame: one column per requested name, indexed like data.
+
+        Raises:
+            KeyError: if a name is neither a column of data nor a registered feature.
+        """
+        names = list(names)
+        computed = {}
+        for name in self.resolve(names, available=data.columns):
+            feature = self._features[name]
+            inputs = []
+            for input_name in feature.inputs:
+                if input_name in computed:
+                    inputs.append(computed[input_name])
+                elif input_name in data.columns:
+                    inputs.append(data[input_name])
+                else:
+                    raise KeyError(f"Input {input_name} of feature {name} is missing from the data")
+            computed[name] = feature.compute(*inputs)
+        missing = [n for n in names if n not in computed and n not in data.columns]
+        if missing:
+            raise KeyError(f"Features {missing} are neither registered nor columns of the data")
+        return pd.DataFrame({n: computed[n] if n in computed else data[n] for n in names}, index=data.index)
+
+
+LAGS = (1, 2)
+LAGGED_SUFFIXES = tuple(f'_t{lag}' for lag in LAGS)
+
+
+def is_lagged(name: str) -> bool:
+    """ Whether name is the lagged value of an input (X_t1, X_t2) rather than a feature on its own """
+    return name.endswith(LAGGED_SUFFIXES)
+
+
+def is_target(name: str) -> bool:
+    """ Whether name is a forward position target (see targets.target_name) """
+    return name.startswith('forward_')
+
+
+def _difference(current: pd.Series, previous: pd.Series) -> pd.Series:
+    return current - previous
+
+
+def _next_change(series: pd.Series) -> pd.Series:
+    return series.shift(-1) - series
+
+
+def _register_raw_lags(registry: FeatureRegistry, name: str) -> None:
+    """ Registers the values of a raw column one and two reports back, e.g. ManagedMoney_NetPosition_t1 """
+    for lag in LAGS:
+        registry.register(f'{name}_t{lag}', [name], lambda series, lag=lag: series.shift(lag))
+
+
+def _register_with_lags(registry: FeatureRegistry,
+                        name: str,
+                        inputs: list[str],
+                        compute: Callable[..., pd.Series]) -> None:
+    """
+    Registers a derived feature and its lagged values.
+
+    Lagged values are computed from the lagged inputs rather than by shifting the feature, so that a single
+    row holding current and lagged raw inputs is enough to compute them.
+    """
+    registry.register(name, inputs, compute)
+    for lag in LAGS:
+        registry.register(f'{name}_t{lag}', [f'{i}_t{lag}' for i in inputs], compute)
+
+
+def _build_dataset_features() -> FeatureRegistry:
+    """
+    Declares the report-level features built by DataSetBuilder.
+
+    Backward looking features are written in terms of current and lagged inputs (X, X_t1, X_t2, X_5d_ago),
+    so that they can be computed either from a time ordered report series, where lags are shifts, or from
+    rows that carry the lagged inputs explicitly, as the live inference tab does.
+    """
+    registry = FeatureRegistry()
+    for name in POSITIONS + ['AGG_OI',
+                             'F1_RolledPrice',
+                             'F2_RolledPrice',
+                             'F3_RolledPrice',
+                             'beta_ols_10',
+                             'prior_cumulative_5D_F1_Volume',
+                             'prior_cumulative_5D_F2_Volume']:
+        _register_raw_lags(registry, name)
+
+    for position in POSITIONS:
+        scaled = f'{position}_to_openinterest'
+        _register_with_lags(registry, scaled, [position, 'AGG_OI'], lambda p, oi: p / oi)
+        for name in [position, scaled]:
+            registry.register(f'{name}_change', [name, f'{name}_t1'], _difference)
+            registry.register(f'prior_report_{name}_change', [f'{name}_t1', f'{name}_t2'], _difference)
+        for horizon in HORIZONS:
+            registry.register(target_name(position, scaled=False, horizon=horizon), [position],
+                              lambda p, horizon=horizon: forward_change(p, horizon))
+            registry.register(target_name(position, scaled=True, horizon=horizon), [scaled],
+                              lambda p, horizon=horizon: forward_change(p, horizon))
+
+    _register_with_lags(registry,
+                        'SyntheticF1MinusF2_RolledPrice',
+                        ['F1_RolledPrice', 'F2_RolledPrice', 'beta_ols_10'],
+                        lambda f1, f2, beta: f1 - beta * f2)
+    registry.register('prior_report_SyntheticF1MinusF2_RolledPrice_change',
+                      ['SyntheticF1MinusF2_RolledPrice', 'SyntheticF1MinusF2_RolledPrice_t1'],
+                      _difference)
+    _register_with_lags(registry,
+                        'prior_cumulative_5D_F1MinusF2_Volume',
+                        ['prior_cumulative_5D_F1_Volume', 'prior_cumulative_5D_F2_Volume'],
+                        _difference)
+    for name in ['F1', 'F2', 'AGG']:
+        registry.register(f'prior_5D_{name}_OI_change', [f'{name}_OI', f'{name}_OI_5d_ago'], _difference)
+    registry.register('prior_5D_F1MinusF2_openinterest_change',
+                      ['prior_5D_F1_OI_change', 'prior_5D_F2_OI_change'],
+                      _difference)
+    for name in ['prior_cumulative_5D_F1_Volume',
+                 'prior_cumulative_5D_F2_Volume',
+                 'prior_cumulative_5D_F1MinusF2_Volume',
+                 'F1_RolledPrice',
+                 'F2_RolledPrice',
+                 'F3_RolledPrice']:
+        registry.register(f'{name}_change', [name, f'{name}_t1'], _difference)
+        registry.register(f'next_{name}_change', [name], _next_change)
+    return registry
+
+
+DATASET_FEATURES = _build_dataset_features()
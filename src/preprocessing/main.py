@@ -15,14 +15,36 @@ from src.preprocessing.openinterest import OpenInterestPanel
 from src.preprocessing.synthetic_spread import SyntheticSpreadBuilder, HedgeMethod
 from src.preprocessing.cot import COTPanel
 from src.preprocessing.dataset_builder import DataSetBuilder
+from src.preprocessing.roller import FuturesRoller, RollRule, compare_rolled_prices
+from src.preprocessing.roll_recency import RollRecencyPanel
+from src.preprocessing.targets import HORIZONS
 
 from src.utils.io.read import RawDataReader
-from src.utils.dates import get_nyse_business_dates
+from src.utils.dates import BusinessCalendar, get_nyse_business_dates
+from src.utils.memory import cast_floats, get_memory_report
 from src.settings import Settings
 
 
-def preprocess_all(ticker: FutureTicker)->None:
+def compact_panel(panel_builder, dtype: str, name: str) -> pd.DataFrame:
+    """ Casts a panel built at float64 to dtype and returns the float64 panel, the reference of the precision check """
+    full_precision_panel = panel_builder.panel
+    panel_builder.dtype = dtype
+    panel_builder.panel = cast_floats(full_precision_panel.copy(), dtype)
+    panel_builder.memory_report = get_memory_report(panel_builder.panel, name=name)
+    return full_precision_panel
+
+
+def preprocess_all(ticker: FutureTicker,
+                   dtype: str = 'float64',
+                   precision_check_features: list[str] = None,
+                   roll_prices: bool = False,
+                   roll_tolerance: float = 0.05,
+                   horizons: tuple = HORIZONS)->None:
     
+    # with a precision check, the panels are built at float64 and cast afterwards, so that the reference dataset
+    # is built from the full precision panels rather than from float32 panels cast back to float64
+    check_precision = dtype != 'float64' and bool(precision_check_features)
+    panel_dtype = 'float64' if check_precision else dtype
     RAW_DATA_PATH = Settings.historical.paths.RAW_DATA_PATH
     PREPROCESSED_DATA_PATH = Settings.historical.paths.PREPROCESSED_DATA_PATH
     rdr = RawDataReader(raw_data_directory= RAW_DATA_PATH)
@@ -40,14 +62,40 @@ def preprocess_all(ticker: FutureTicker)->None:
     business_dates = get_nyse_business_dates(prices_db['tradeDate'].min(),
                                              prices_db['tradeDate'].max())
     prices_db = prices_db[prices_db['tradeDate'].isin(business_dates)]
-    price_panel_builder = PricePanel()
+    if roll_prices:
+        # rebuild the continuous series from the raw generic contracts instead of the vendor rolled prices
+        for name in ['F1_Price', 'F2_Price', 'F3_Price']:
+            prices_db.loc[:, name] = pd.to_numeric(prices_db[name], errors='coerce')
+        prices_db = prices_db.dropna(subset=['F1_Price', 'F2_Price', 'F3_Price'])
+        # the vendor rolls two business days before expiry, the roll dates follow the exchange expiry schedule
+        roller = FuturesRoller(rule=RollRule.CALENDAR, ticker=ticker, roll_days_before=2)
+        roller.fit(prices_db)
+        # the last contract cannot roll early, so F3 only matches the vendor series between rolls
+        mismatch = compare_rolled_prices(roller.panel, prices_db, columns=['F1_RolledPrice', 'F2_RolledPrice'])
+        if (mismatch > roll_tolerance).any():
+            raise ValueError(f"Rolled prices of {ticker.name} differ from the vendor rolled prices on "
+                             f"{mismatch.to_dict()} of the days, above the tolerance {roll_tolerance}")
+        prices_db = roller.panel
+    price_panel_builder = PricePanel(dtype=panel_dtype)
     price_panel_builder.fit(dataset=prices_db)
+    if check_precision:
+        full_precision_prices = compact_panel(price_panel_builder, dtype, name='prices')
 
     price_panel_builder.panel.to_csv(PREPROCESSED_DATA_PATH / f'{ticker.name}_prices_panel.csv', index=False)
 
+    # the calendar runs a few months past the last price so the next roll and expiry dates are known
+    calendar = BusinessCalendar.from_ticker(ticker,
+                                            prices_db['tradeDate'].min(),
+                                            prices_db['tradeDate'].max() + pd.Timedelta(days=120))
+    roll_recency_builder = RollRecencyPanel(ticker=ticker, business_dates=calendar)
+    roll_recency_builder.fit(dataset=price_panel_builder.panel[['tradeDate']])
+    roll_recency_builder.panel.to_csv(PREPROCESSED_DATA_PATH / f'{ticker.name}_roll_recency_panel.csv', index=False)
+
     synthetic_spread_builder = SyntheticSpreadBuilder(method=HedgeMethod.OLS, windows=[10, 20])
     synthetic_spread_db = synthetic_spread_builder.compute(price_panel_builder.panel)
     synthetic_spread_db.to_csv(PREPROCESSED_DATA_PATH / f'{ticker.name}_synthetic_spread_db.csv', index=False)
+    if check_precision:
+        full_precision_synthetic_spread_db = synthetic_spread_builder.compute(full_precision_prices)
 
 
 
@@ -60,8 +108,10 @@ def preprocess_all(ticker: FutureTicker)->None:
     volume_db['tradeDate'] = pd.to_datetime(volume_db['tradeDate']).dt.date
     volume_db = volume_db[volume_db['tradeDate'].isin(business_dates)]
 
-    volume_panel_builder = VolumePanel()
+    volume_panel_builder = VolumePanel(dtype=panel_dtype)
     volume_panel_builder.fit(dataset=volume_db)
+    if check_precision:
+        full_precision_volume = compact_panel(volume_panel_builder, dtype, name='volume')
 
     volume_panel_builder.panel.to_csv(PREPROCESSED_DATA_PATH / f'{ticker.name}_volume_panel.csv', index=False)
 
@@ -77,8 +127,10 @@ def preprocess_all(ticker: FutureTicker)->None:
     openinterest_db['tradeDate'] = pd.to_datetime(openinterest_db['tradeDate']).dt.date
     openinterest_db = openinterest_db[openinterest_db['tradeDate'].isin(business_dates)]
 
-    openinterest_panel_builder = OpenInterestPanel()
+    openinterest_panel_builder = OpenInterestPanel(dtype=panel_dtype)
     openinterest_panel_builder.fit(dataset=openinterest_db)
+    if check_precision:
+        full_precision_openinterest = compact_panel(openinterest_panel_builder, dtype, name='openinterest')
     openinterest_panel_builder.panel.to_csv(PREPROCESSED_DATA_PATH / f'{ticker.name}_openinterest_panel.csv', index=False)
 
 
@@ -96,20 +148,36 @@ def preprocess_all(ticker: FutureTicker)->None:
 
     ]]
     cot_db = all_cot_db[all_cot_db['Name']== ticker.value]
-    cot_panel_builder = COTPanel()
+    cot_panel_builder = COTPanel(horizons=horizons)
     cot_panel_builder.fit(dataset=cot_db)
     cot_panel_builder.panel.to_csv(PREPROCESSED_DATA_PATH / f'{ticker.name}_cot_panel.csv', index=False)
 
 
 
-    dataset_builder = DataSetBuilder()
+    dataset_builder = DataSetBuilder(dtype=dtype,
+                                     precision_check_features=precision_check_features,
+                                     horizons=horizons)
     dataset_builder.fit(cot_db=cot_panel_builder.panel,
                             synthetic_spread_db=synthetic_spread_db,
                             volume_db=volume_panel_builder.panel,
                             openinterest_db=openinterest_panel_builder.panel)
+    if check_precision:
+        reference_builder = DataSetBuilder(dtype='float64', horizons=horizons)
+        reference_builder.fit(cot_db=cot_panel_builder.panel,
+                              synthetic_spread_db=full_precision_synthetic_spread_db,
+                              volume_db=full_precision_volume,
+                              openinterest_db=full_precision_openinterest)
+        print(dataset_builder.check_precision(reference=reference_builder.data).to_string(index=False))
 
     dataset_builder.data.to_csv(PREPROCESSED_DATA_PATH / f'{ticker.name}_dataset.csv', index=False)
 
+    memory_report = pd.DataFrame([price_panel_builder.memory_report,
+                                  volume_panel_builder.memory_report,
+                                  openinterest_panel_builder.memory_report,
+                                  dataset_builder.memory_report])
+    print(f"{ticker.name} panels memory footprint ({dtype}):")
+    print(memory_report.to_string(index=False))
+
 
 
 
@@ -0,0 +1,231 @@
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from src.preprocessing.feature_computer import MODEL_FEATURES, compute_features
+from src.preprocessing.feature_registry import DATASET_FEATURES, FeatureRegistry
+
+
+class _RollingMoments:
+    """ Running sum and sum of squares of the last size values, NaN until the window is full of values """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.values = deque(maxlen=size)
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.n_missing = 0
+
+    def push(self, value: float) -> None:
+        if len(self.values) == self.size:
+            old = self.values[0]
+            if np.isnan(old):
+                self.n_missing -= 1
+            else:
+                self.total -= old
+                self.total_squares -= old * old
+        self.values.append(value)
+        if np.isnan(value):
+            self.n_missing += 1
+        else:
+            self.total += value
+            self.total_squares += value * value
+
+    @property
+    def ready(self) -> bool:
+        return len(self.values) == self.size and self.n_missing == 0
+
+    @property
+    def sum(self) -> float:
+        return self.total if self.ready else np.nan
+
+    @property
+    def std(self) -> float:
+        if not self.ready:
+            return np.nan
+        variance = (self.total_squares - self.total * self.total / self.size) / (self.size - 1)
+        return float(np.sqrt(max(variance, 0.0)))
+
+
+class _RollingBeta:
+    """ Running OLS slope of y on x (with intercept) over the last size pairs """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.pairs = deque(maxlen=size)
+        self.sums = np.zeros(4)  # sum x, sum y, sum x^2, sum x*y
+        self.n_missing = 0
+
+    @staticmethod
+    def _moments(x: float, y: float) -> np.ndarray:
+        return np.array([x, y, x * x, x * y])
+
+    def push(self, x: float, y: float) -> None:
+        if len(self.pairs) == self.size:
+            old = self.pairs[0]
+            if np.isnan(old).any():
+                self.n_missing -= 1
+            else:
+                self.sums -= self._moments(*old)
+        self.pairs.append((x, y))
+        if np.isnan(x) or np.isnan(y):
+            self.n_missing += 1
+        else:
+            self.sums += self._moments(x, y)
+
+    @property
+    def beta(self) -> float:
+        if len(self.pairs) < self.size or self.n_missing:
+            return np.nan
+        sum_x, sum_y, sum_xx, sum_xy = self.sums
+        denominator = self.size * sum_xx - sum_x * sum_x
+        return (self.size * sum_xy - sum_x * sum_y) / denominator if denominator else np.nan
+
+
+class NowcastFeatureUpdater:
+    """
+    Keeps the state of the week in progress and advances the nowcast features one trading day at a time.
+
+    The nowcast row of the week in progress compares the latest daily data with the last released COT
+    report (t1) and the one before (t2). The daily part of the state, i.e. 5 day cumulative volumes, open
+    interest 5 days ago, 20 day price volatilities and the 10 day OLS hedge ratio of the synthetic spread,
+    is held in fixed size windows with running sums, so advance costs O(1) whatever the history length.
+    The features themselves go through the same registry as DataSetBuilder and the inference tab.
+
+    Daily rows must hold tradeDate, F1/F2/F3_RolledPrice, F1/F2_Volume and F1/F2/AGG_OI. Report rows must
+    hold tradeDate, the ManagedMoney positions and AGG_OI.
+
+    Examples
+    --------
+    >>> updater = NowcastFeatureUpdater()
+    >>> updater.fit(reports=dataset, daily=daily_db)
+    >>> row = updater.advance(new_day)
+    >>> engine.predict_batch('nowcast', row)
+    """
+
+    PRICE_COLUMNS = ['F1_RolledPrice', 'F2_RolledPrice', 'F3_RolledPrice']
+    VOLUME_COLUMNS = ['F1_Volume', 'F2_Volume']
+    OPENINTEREST_COLUMNS = ['F1_OI', 'F2_OI', 'AGG_OI']
+    POSITION_COLUMNS = ['ManagedMoney_NetPosition', 'ManagedMoney_LongPosition', 'ManagedMoney_ShortPosition']
+
+    def __init__(self,
+                 features: list[str] = MODEL_FEATURES,
+                 volume_window: int = 5,
+                 openinterest_lag: int = 5,
+                 volatility_window: int = 20,
+                 beta_window: int = 10,
+                 registry: FeatureRegistry = DATASET_FEATURES) -> None:
+        self.features = features
+        self.volume_window = volume_window
+        self.openinterest_lag = openinterest_lag
+        self.volatility_window = volatility_window
+        self.beta_window = beta_window
+        self.registry = registry
+        # enough daily history to fill every window
+        self.warmup = max(volume_window, openinterest_lag + 1, volatility_window + 1, beta_window + 1)
+        self._reset()
+
+    def _reset(self) -> None:
+        self._volumes = {name: _RollingMoments(self.volume_window) for name in self.VOLUME_COLUMNS}
+        self._openinterest = {name: deque(maxlen=self.openinterest_lag + 1) for name in self.OPENINTEREST_COLUMNS}
+        self._price_changes = {name: _RollingMoments(self.volatility_window) for name in self.PRICE_COLUMNS}
+        self._beta = _RollingBeta(self.beta_window)
+        self._last_prices = {name: np.nan for name in self.PRICE_COLUMNS}
+        self._snapshots = deque(maxlen=15)
+        self._reports = deque(maxlen=2)
+        self.last_date = None
+        self.row = None
+
+    def _daily_inputs(self) -> dict:
+        """ Current values of the daily inputs of the features """
+        inputs = {name: self._last_prices[name] for name in self.PRICE_COLUMNS}
+        for name in self.PRICE_COLUMNS:
+            inputs[f'{name}_rolling_20D_volatility'] = self._price_changes[name].std
+        for name in self.VOLUME_COLUMNS:
+            inputs[f'prior_cumulative_5D_{name}'] = self._volumes[name].sum
+        for name, window in self._openinterest.items():
+            inputs[name] = window[-1] if window else np.nan
+            inputs[f'{name}_5d_ago'] = window[0] if len(window) == window.maxlen else np.nan
+        return inputs
+
+    def _push(self, day: pd.Series) -> None:
+        # the hedge ratio of a day is fitted on the previous days only, as in SyntheticSpreadBuilder
+        beta = self._beta.beta
+        f1, f2 = float(day['F1_RolledPrice']), float(day['F2_RolledPrice'])
+        self._beta.push(f2, f1)
+        for name in self.PRICE_COLUMNS:
+            price = float(day[name])
+            self._price_changes[name].push(price - self._last_prices[name])
+            self._last_prices[name] = price
+        for name in self.VOLUME_COLUMNS:
+            self._volumes[name].push(float(day[name]))
+        for name in self.OPENINTEREST_COLUMNS:
+            self._openinterest[name].append(float(day[name]))
+        snapshot = self._daily_inputs()
+        snapshot['beta_ols_10'] = beta
+        self._snapshots.append((pd.Timestamp(day['tradeDate']), snapshot))
+        self.last_date = pd.Timestamp(day['tradeDate'])
+
+    def _current_row(self) -> pd.DataFrame:
+        date, current = self._snapshots[-1]
+        raw = dict(current)
+        if self._reports:
+            report_date, _ = self._reports[-1]
+            anchor = next((s for d, s in reversed(self._snapshots) if d == report_date), {})
+            for name, value in anchor.items():
+                raw[f'{name}_t1'] = value
+            for lag, (_, report) in zip((1, 2), reversed(self._reports)):
+                for name, value in report.items():
+                    raw[f'{name}_t{lag}'] = value
+        raw = pd.DataFrame({name: [value] for name, value in raw.items()}, index=pd.Index([date], name='tradeDate'))
+        return compute_features(raw, features=self.features, registry=self.registry)
+
+    def add_report(self, report: pd.Series) -> None:
+        """
+        Registers a newly released COT report, which becomes t1 and shifts the previous one to t2.
+
+        Args:
+            report: report row with tradeDate, the ManagedMoney positions and AGG_OI. Its trade date must be
+                one of the last days advanced so that its daily inputs are known.
+        """
+        values = {name: float(report[name]) for name in self.POSITION_COLUMNS + ['AGG_OI']}
+        self._reports.append((pd.Timestamp(report['tradeDate']), values))
+
+    def advance(self, day: pd.Series) -> pd.DataFrame:
+        """
+        Advances the state by one trading day and emits the nowcast feature row of that day.
+
+        Args:
+            day: daily row, see the class docstring. Days must be passed in date order.
+
+        Returns:
+            pd.DataFrame: one row, indexed by the trade date, with one column per feature.
+        """
+        if self.last_date is not None and pd.Timestamp(day['tradeDate']) <= self.last_date:
+            raise ValueError(f"Day {day['tradeDate']} is not after the last advanced day {self.last_date}")
+        self._push(day)
+        self.row = self._current_row()
+        return self.row
+
+    def fit(self, reports: pd.DataFrame, daily: pd.DataFrame) -> None:
+        """
+        Rebuilds the state from history: the last two reports and the daily rows up to the latest day.
+
+        Only the daily rows needed to fill the windows before the second to last report are replayed.
+
+        Args:
+            reports: report rows, see add_report.
+            daily: daily rows, see advance.
+        """
+        self._reset()
+        reports = reports.assign(tradeDate=pd.to_datetime(reports['tradeDate'])).sort_values('tradeDate').tail(2)
+        daily = daily.assign(tradeDate=pd.to_datetime(daily['tradeDate'])).sort_values('tradeDate')
+        start = np.searchsorted(daily['tradeDate'].values, reports['tradeDate'].values[0], side='left')
+        daily = daily.iloc[max(start - self.warmup, 0):]
+        report_dates = dict(zip(reports['tradeDate'], range(len(reports))))
+        for _, day in daily.iterrows():
+            self._push(day)
+            if day['tradeDate'] in report_dates:
+                self.add_report(reports.iloc[report_dates[day['tradeDate']]])
+        self.row = self._current_row()
@@ -1,14 +1,19 @@
 import pandas as pd
 
+from src.utils.memory import cast_floats, get_memory_report, validate_float_dtype
+
 
 class PricePanel():
 
     def __init__(self,
                  lookback_windows: int = list(range(1, 20)),
-                 lookforward_windows: int = list(range(1, 20))) -> None:
+                 lookforward_windows: int = list(range(1, 20)),
+                 dtype: str = 'float64') -> None:
         self.lookback_windows = lookback_windows
         self.lookforward_windows = lookforward_windows
+        self.dtype = validate_float_dtype(dtype)
         self.panel = None
+        self.memory_report = None
 
     def compute_backward_features(self, dataset: pd.DataFrame) -> pd.DataFrame:
         dataset['F1MinusF2_RolledPrice'] = dataset['F1_RolledPrice'] - dataset['F2_RolledPrice']
@@ -38,4 +43,5 @@ class PricePanel():
         dataset['F1MinusF2_RolledPrice'] = dataset['F1_RolledPrice'] - dataset['F2_RolledPrice']
         dataset = self.compute_backward_features(dataset)
         dataset = self.compute_forward_features(dataset)
-        self.panel = dataset
+        self.panel = cast_floats(dataset, self.dtype)
+        self.memory_report = get_memory_report(self.panel, name='prices')
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from src.preprocessing.base import FutureTicker
+from src.utils.dates import BusinessCalendar, to_datetime64
+from src.utils.expiry import get_expiry_dates
+
+
+class RollRecencyPanel():
+    """
+    Roll recency and days to expiry features.
+
+    Index rolls happen between the roll_start_day-th and the roll_end_day-th business day of each month.
+    For every trade date the panel adds the signed business day distances to the next roll start and end,
+    since the last roll end, a flag for days inside the roll window, and the number of business days left
+    until the expiry of the front contract. All distances are lookups in the ordinal index of the calendar.
+    """
+
+    def __init__(self,
+                 ticker: FutureTicker,
+                 business_dates,
+                 roll_start_day: int = 5,
+                 roll_end_day: int = 9) -> None:
+        self.ticker = ticker
+        self.calendar = (business_dates if isinstance(business_dates, BusinessCalendar)
+                         else BusinessCalendar(business_dates))
+        self.roll_start_day = roll_start_day
+        self.roll_end_day = roll_end_day
+        self.panel = None
+
+    def fit(self, dataset: pd.DataFrame) -> None:
+        dataset = dataset.sort_values(by='tradeDate', ascending=True).reset_index(drop=True)
+        dates = to_datetime64(dataset['tradeDate'])
+        months = dates.astype('datetime64[M]')
+        # roll windows of the previous, current and next months
+        starts = {shift: self.calendar.nth_of_month(months + shift, self.roll_start_day)
+                  for shift in (0, 1)}
+        ends = {shift: self.calendar.nth_of_month(months + shift, self.roll_end_day)
+                for shift in (-1, 0, 1)}
+
+        next_roll_start = np.where(dates <= starts[0], starts[0], starts[1])
+        next_roll_end = np.where(dates <= ends[0], ends[0], ends[1])
+        last_roll_end = np.where(dates >= ends[0], ends[0], ends[-1])
+        dataset['days_to_next_roll_start'] = self.calendar.count(dates, next_roll_start)
+        dataset['days_to_next_roll_end'] = self.calendar.count(dates, next_roll_end)
+        dataset['days_since_last_roll_end'] = self.calendar.count(last_roll_end, dates)
+        dataset['in_roll_window'] = (dates >= starts[0]) & (dates <= ends[0])
+
+        # front contract: first contract whose expiry is on or after the trade date
+        contract_months = np.arange(months.min() - 1, months.max() + 4)
+        expiries = get_expiry_dates(self.ticker, contract_months, self.calendar)
+        front_expiry = expiries[np.searchsorted(expiries, dates, side='left')]
+        dataset['front_contract_expiry'] = pd.to_datetime(front_expiry).date
+        dataset['days_to_expiry'] = self.calendar.count(dates, front_expiry)
+        self.panel = dataset
@@ -0,0 +1,385 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from src.utils.expiry import get_expiry_schedule
+
+
+class RollRule(Enum):
+    """Rules used to detect the day the front contracts change."""
+    SPREAD = "spread"          # new F2 - F1 matches the previous F3 - F2 (needs three contracts)
+    FRONT_JUMP = "front_jump"  # F1 jumps to the previous F2 while the F2 - F1 spread collapses
+    CALENDAR = "calendar"      # first trading day on or after each roll date, by default the day after each expiry
+
+
+class AdjustmentMethod(Enum):
+    BACKWARD = "backward"  # Panama method: history is shifted by the roll gaps, latest prices are unchanged
+    FORWARD = "forward"    # history is unchanged, prices after each roll are shifted by the gap
+    RATIO = "ratio"        # history is multiplied by the ratio of new to old contract prices
+
+
+@dataclass
+class RollEvent:
+    """Represents a single roll event."""
+    date: pd.Timestamp
+    gap: float  # Price gap at roll (new contract - old contract) of the front contract
+    from_price: float  # Price of expiring contract
+    to_price: float  # Price of new front contract
+
+
+class FuturesRoller:
+    """
+    Builds continuous F1/F2/F3 series from raw generic contract prices with array operations.
+
+    The roller keeps, for every day, the cumulative gap of the rolls up to that day. Appending new days with
+    update only detects rolls on the new rows and extends that cumulative gap; the back-adjusted history is a
+    single vector operation away from it and never needs the roll detection or the adjustments to be redone.
+
+    Parameters
+    ----------
+    rule : RollRule, default=RollRule.CALENDAR
+        Rule used to detect roll days. The price based rules (SPREAD, FRONT_JUMP) misfire on days when the
+        spreads between contracts move, CALENDAR follows the exchange expiries.
+    adjustment : AdjustmentMethod, default=AdjustmentMethod.BACKWARD
+        Method used to adjust prices around rolls.
+    roll_days_before : int, default=0
+        Number of trading days before the detected roll the continuous series switches to the next contract.
+        During that window F_k uses the price of F_k+1. The last contract cannot roll early.
+    min_spread : float, default=0.05
+        Minimum absolute spread between consecutive contracts for a price move to be considered a roll.
+    roll_dates : list of dates, optional
+        Roll dates used by RollRule.CALENDAR.
+    ticker : FutureTicker or symbol, optional
+        Ticker whose expiry schedule (see get_expiry_schedule) gives the roll dates of RollRule.CALENDAR when
+        roll_dates is None: the front contract changes on the first trading day after each expiry.
+    price_columns : list of str
+        Raw generic contract prices, front contract first.
+    rolled_columns : list of str
+        Names of the continuous series added to the panel.
+
+    Examples
+    --------
+    >>> roller = FuturesRoller(ticker=FutureTicker.WTI, adjustment=AdjustmentMethod.BACKWARD)
+    >>> roller.fit(prices_db)
+    >>> roller.update(new_prices_db)
+    >>> roller.panel[['tradeDate', 'F1_RolledPrice']]
+    """
+
+    def __init__(self,
+                 rule: RollRule = RollRule.CALENDAR,
+                 adjustment: AdjustmentMethod = AdjustmentMethod.BACKWARD,
+                 roll_days_before: int = 0,
+                 min_spread: float = 0.05,
+                 roll_dates: list = None,
+                 ticker=None,
+                 price_columns: List[str] = ['F1_Price', 'F2_Price', 'F3_Price'],
+                 rolled_columns: List[str] = ['F1_RolledPrice', 'F2_RolledPrice', 'F3_RolledPrice']) -> None:
+        if not isinstance(rule, RollRule):
+            raise ValueError("rule must be an instance of RollRule Enum")
+        if not isinstance(adjustment, AdjustmentMethod):
+            raise ValueError("adjustment must be an instance of AdjustmentMethod Enum")
+        if rule == RollRule.SPREAD and len(price_columns) < 3:
+            raise ValueError("RollRule.SPREAD needs at least three contracts")
+        if rule == RollRule.CALENDAR and roll_dates is None and ticker is None:
+            raise ValueError("RollRule.CALENDAR needs roll_dates or a ticker")
+        if len(price_columns) != len(rolled_columns):
+            raise ValueError("price_columns and rolled_columns must have the same length")
+        self.rule = rule
+        self.adjustment = adjustment
+        self.roll_days_before = roll_days_before
+        self.min_spread = min_spread
+        self.roll_dates = None if roll_dates is None else np.sort(pd.to_datetime(roll_dates).values)
+        self.ticker = ticker
+        self.price_columns = price_columns
+        self.rolled_columns = rolled_columns
+        self._reset()
+
+    def _reset(self) -> None:
+        n_contracts = len(self.price_columns)
+        self._data = pd.DataFrame()
+        self._dates = np.array([], dtype='datetime64[ns]')
+        self._raw = np.empty((0, n_contracts))
+        self._selected = np.empty((0, n_contracts))
+        self._gaps = np.empty((0, n_contracts))
+        self._cumulative_gaps = np.empty((0, n_contracts))
+        self._roll_positions = np.array([], dtype=int)
+
+    def _expiry_roll_dates(self, dates: np.ndarray) -> np.ndarray:
+        """ Day after each expiry of the ticker over the span of dates """
+        first, last = pd.Timestamp(dates[0]).date(), pd.Timestamp(dates[-1]).date()
+        schedule = get_expiry_schedule([self.ticker], first, last + pd.Timedelta(days=120))
+        return np.sort(pd.to_datetime(schedule['expiryDate']).values + np.timedelta64(1, 'D'))
+
+    def _detect(self, prices: np.ndarray, dates: np.ndarray, start: int) -> np.ndarray:
+        """ Positions, at or after start, of the rows where the front contract changed since the previous row """
+        if self.rule == RollRule.CALENDAR:
+            roll_dates = self.roll_dates if self.roll_dates is not None else self._expiry_roll_dates(dates)
+            positions = np.unique(np.searchsorted(dates, roll_dates, side='left'))
+            return positions[(positions >= max(start, 1)) & (positions < len(dates))]
+
+        lo = max(start, 1)
+        f1, f2 = prices[lo - 1:, 0], prices[lo - 1:, 1]
+        spread_12 = f2 - f1
+        curr_12, prev_12 = spread_12[1:], spread_12[:-1]
+        with np.errstate(invalid='ignore'):
+            if self.rule == RollRule.SPREAD:
+                prev_23 = (prices[lo - 1:, 2] - f2)[:-1]
+                is_roll = ((np.abs(curr_12 - prev_23) < 0.5 * np.abs(curr_12 - prev_12))
+                           & (np.abs(prev_12 - prev_23) > self.min_spread)
+                           & (np.abs(prev_12) > self.min_spread))
+            else:
+                front_move = np.abs(np.diff(f1))
+                second_move = np.abs(np.diff(f2))
+                collapsed = np.abs(curr_12) < 0.5 * np.abs(prev_12)
+                jumped = np.abs(f1[1:] - f2[:-1]) < 0.5 * np.abs(prev_12)
+                sign_change = (((prev_12 > self.min_spread) & (curr_12 < self.min_spread))
+                               | ((prev_12 < -self.min_spread) & (curr_12 > -self.min_spread)))
+                is_roll = ((np.abs(prev_12) > self.min_spread)
+                           & (collapsed | jumped | sign_change)
+                           & (np.nan_to_num(front_move) > np.nan_to_num(second_move) + 0.3 * np.abs(prev_12)))
+        return np.flatnonzero(is_roll) + lo
+
+    def _append(self, dataset: pd.DataFrame) -> None:
+        n_history = len(self._dates)
+        dates = np.concatenate([self._dates, pd.to_datetime(dataset['tradeDate']).values])
+        raw = np.vstack([self._raw, dataset[self.price_columns].to_numpy(dtype=float)])
+        new_rolls = self._detect(raw, dates, start=n_history)
+        n_rows, n_contracts = raw.shape
+        last = n_contracts - 1
+
+        selected = np.vstack([self._selected, raw[n_history:]])
+        gaps = np.vstack([self._gaps, np.zeros((n_rows - n_history, n_contracts))])
+        first_changed_row = n_history
+        if len(new_rolls):
+            # effective roll row of each contract: early for all but the last one
+            early = np.maximum(new_rolls - self.roll_days_before, 1)
+            effective = np.repeat(early[:, None], n_contracts, axis=1)
+            effective[:, last] = new_rolls
+            if self.roll_days_before > 0 and n_contracts > 1:
+                window = np.zeros(n_rows + 1, dtype=int)
+                np.add.at(window, early, 1)
+                np.add.at(window, new_rolls, -1)
+                in_window = np.cumsum(window[:-1]) > 0
+                selected[in_window, :last] = raw[in_window, 1:]
+            # old and new contract prices on the day before the effective roll
+            old_price = raw[effective - 1, np.arange(n_contracts)]
+            new_price = np.empty_like(old_price)
+            if n_contracts > 1:
+                new_price[:, :last] = raw[early - 1][:, 1:]
+                # no later contract to compare the last one with: use the spread to the previous one after the roll
+                new_price[:, last] = old_price[:, last] + raw[new_rolls, last] - raw[new_rolls, last - 1]
+            else:
+                new_price[:, last] = raw[new_rolls, last]
+            if self.adjustment == AdjustmentMethod.RATIO:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    roll_gaps = np.log(new_price / old_price)
+            else:
+                roll_gaps = new_price - old_price
+            np.add.at(gaps, (effective, np.broadcast_to(np.arange(n_contracts), effective.shape)),
+                      np.nan_to_num(roll_gaps, nan=0.0, posinf=0.0, neginf=0.0))
+            first_changed_row = min(first_changed_row, int(early.min()))
+
+        previous = self._cumulative_gaps[first_changed_row - 1] if first_changed_row > 0 else np.zeros(n_contracts)
+        cumulative_gaps = np.vstack([self._cumulative_gaps[:first_changed_row],
+                                     previous + np.cumsum(gaps[first_changed_row:], axis=0)])
+
+        self._data = pd.concat([self._data, dataset], ignore_index=True)
+        self._dates = dates
+        self._raw = raw
+        self._selected = selected
+        self._gaps = gaps
+        self._cumulative_gaps = cumulative_gaps
+        self._roll_positions = np.concatenate([self._roll_positions, new_rolls])
+
+    def _rolled_prices(self) -> np.ndarray:
+        if self.adjustment == AdjustmentMethod.BACKWARD:
+            return self._selected + (self._cumulative_gaps[-1] - self._cumulative_gaps)
+        if self.adjustment == AdjustmentMethod.FORWARD:
+            return self._selected - self._cumulative_gaps
+        return self._selected * np.exp(self._cumulative_gaps[-1] - self._cumulative_gaps)
+
+    @property
+    def panel(self) -> pd.DataFrame:
+        """ Raw data with the continuous series added """
+        panel = self._data.copy()
+        if len(panel):
+            panel[self.rolled_columns] = self._rolled_prices()
+        return panel
+
+    def fit(self, dataset: pd.DataFrame) -> None:
+        """
+        Builds the continuous series from scratch.
+
+        Args:
+            dataset (pd.DataFrame): must contain tradeDate and price_columns for a single ticker.
+        """
+        self._reset()
+        self._append(dataset.sort_values('tradeDate').reset_index(drop=True))
+
+    def update(self, dataset: pd.DataFrame) -> None:
+        """
+        Appends new days to the continuous series.
+
+        Rows dated on or before the last fitted day are ignored. Rolls are only detected on the new rows.
+
+        Args:
+            dataset (pd.DataFrame): must contain tradeDate and price_columns for the same ticker as fit.
+        """
+        dataset = dataset.sort_values('tradeDate').reset_index(drop=True)
+        if len(self._dates):
+            dataset = dataset[pd.to_datetime(dataset['tradeDate']).values > self._dates[-1]]
+        if len(dataset):
+            self._append(dataset.reset_index(drop=True))
+
+    @property
+    def roll_events_(self) -> List[RollEvent]:
+        """ Detected roll events of the front contract """
+        gaps = self._gaps[:, 0]
+        effective = np.maximum(self._roll_positions - self.roll_days_before, 1)
+        if len(self.price_columns) == 1:
+            effective = self._roll_positions
+        return [RollEvent(date=pd.Timestamp(self._dates[r]),
+                          gap=float(gaps[e]),
+                          from_price=float(self._raw[r - 1, 0]),
+                          to_price=float(self._raw[r, 0]))
+                for r, e in zip(self._roll_positions, effective)]
+
+    def get_roll_summary(self) -> pd.DataFrame:
+        """
+        Get a summary DataFrame of all detected roll events.
+
+        Returns
+        -------
+        pd.DataFrame
+            Summary of roll events with dates, gaps, and prices
+        """
+        return pd.DataFrame([{'date': e.date,
+                              'gap': e.gap,
+                              'from_price': e.from_price,
+                              'to_price': e.to_price}
+                             for e in self.roll_events_])
+
+
+class FuturesRollerFromAdjustment:
+    """
+    Reads the roll events out of a rolled reference series, e.g. the vendor F1_RolledPrice, and rebuilds it.
+
+    The adjustment of the reference series is rolled - raw: it only changes on roll days, by minus the roll gap.
+    The events are the tool to check the roll dates and gaps of FuturesRoller against the vendor.
+
+    Parameters
+    ----------
+    roll_days_before : int, default=0
+        Number of trading days before each roll day the history starts to carry its gap.
+    min_gap : float, default=0.01
+        Minimum absolute change of the adjustment counted as a roll, above the price rounding.
+
+    Examples
+    --------
+    >>> roller = FuturesRollerFromAdjustment()
+    >>> rolled = roller.roll_using_target(prices_db, raw_col='F1_Price', target_rolled_col='F1_RolledPrice')
+    >>> roller.get_roll_summary()
+    """
+
+    def __init__(self, roll_days_before: int = 0, min_gap: float = 0.01) -> None:
+        self.roll_days_before = roll_days_before
+        self.min_gap = min_gap
+        self.roll_events_: List[RollEvent] = []
+        self.cumulative_adjustment_ = pd.Series(dtype=float)
+
+    def _roll_positions(self, raw: np.ndarray, rolled: np.ndarray) -> np.ndarray:
+        adjustment_change = np.diff(rolled - raw)
+        with np.errstate(invalid='ignore'):
+            return np.flatnonzero(np.abs(adjustment_change) >= self.min_gap) + 1
+
+    def extract_roll_events_from_target(self, raw_prices: pd.Series, rolled_prices: pd.Series) -> List[RollEvent]:
+        """
+        Roll events of a rolled series, one per change of its adjustment.
+
+        Args:
+            raw_prices (pd.Series): raw generic contract prices, indexed by date.
+            rolled_prices (pd.Series): rolled series of the same contract, on the same index.
+
+        Returns:
+            list[RollEvent]: events dated on the rows where the adjustment changed.
+        """
+        raw = raw_prices.to_numpy(dtype=float)
+        rolled = rolled_prices.to_numpy(dtype=float)
+        positions = self._roll_positions(raw, rolled)
+        gaps = -np.diff(rolled - raw)[positions - 1]
+        return [RollEvent(date=pd.Timestamp(raw_prices.index[r]),
+                          gap=float(gap),
+                          from_price=float(raw[r - 1]),
+                          to_price=float(raw[r]))
+                for r, gap in zip(positions, gaps)]
+
+    def roll_using_target(self, prices_df: pd.DataFrame, raw_col: str, target_rolled_col: str) -> pd.Series:
+        """
+        Back-adjusts a raw series with the roll gaps of a rolled reference series.
+
+        Args:
+            prices_df (pd.DataFrame): tradeDate, raw_col and target_rolled_col for a single ticker.
+            raw_col (str): raw generic contract prices.
+            target_rolled_col (str): rolled reference series.
+
+        Returns:
+            pd.Series: back-adjusted prices indexed by tradeDate, the latest prices unchanged.
+        """
+        prices = prices_df.sort_values('tradeDate').set_index('tradeDate')
+        raw = prices[raw_col].astype(float)
+        self.roll_events_ = self.extract_roll_events_from_target(raw, prices[target_rolled_col].astype(float))
+        positions = self._roll_positions(raw.to_numpy(), prices[target_rolled_col].to_numpy(dtype=float))
+        # each gap shifts the rows before its roll day, moved roll_days_before rows earlier
+        starts = np.maximum(positions - self.roll_days_before, 0)
+        gaps = np.zeros(len(raw) + 1)
+        np.add.at(gaps, starts, [event.gap for event in self.roll_events_])
+        adjustment = gaps[::-1].cumsum()[::-1][1:]
+        self.cumulative_adjustment_ = pd.Series(adjustment, index=raw.index, name='adjustment')
+        return (raw + self.cumulative_adjustment_).rename(target_rolled_col)
+
+    def get_roll_summary(self) -> pd.DataFrame:
+        """
+        Get a summary DataFrame of the roll events read from the reference series.
+
+        Returns
+        -------
+        pd.DataFrame
+            Summary of roll events with dates, gaps, and prices
+        """
+        return pd.DataFrame([{'date': e.date,
+                              'gap': e.gap,
+                              'from_price': e.from_price,
+                              'to_price': e.to_price}
+                             for e in self.roll_events_])
+
+
+def compare_rolled_prices(panel: pd.DataFrame,
+                          reference: pd.DataFrame,
+                          columns: List[str] = ['F1_RolledPrice', 'F2_RolledPrice', 'F3_RolledPrice'],
+                          tolerance: float = 0.011) -> pd.Series:
+    """
+    Share of the daily changes of rolled series that differ from a reference, e.g. the vendor rolled prices.
+
+    Back-adjusted levels differ by a constant wherever the adjustments differ, so the daily changes are compared.
+
+    Args:
+        panel (pd.DataFrame): tradeDate and the rolled columns to check.
+        reference (pd.DataFrame): tradeDate and the reference columns, of the same names.
+        columns (list[str]): rolled columns to compare.
+        tolerance (float): largest difference of daily changes counted as equal, above the price rounding.
+
+    Returns:
+        pd.Series: share of differing daily changes of each column, over the dates both have.
+    """
+    merged = pd.merge(panel[['tradeDate'] + columns], reference[['tradeDate'] + columns],
+                      on='tradeDate', suffixes=('', '_reference')).sort_values('tradeDate')
+    shares = {}
+    for column in columns:
+        changes = merged[column].diff()
+        reference_changes = merged[f'{column}_reference'].diff()
+        known = changes.notna() & reference_changes.notna()
+        shares[column] = float(((changes - reference_changes).abs()[known] > tolerance).mean()) if known.any() else np.nan
+    return pd.Series(shares)
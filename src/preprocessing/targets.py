@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+
+
+HORIZONS = (1, 2, 4, 8)
+
+
+def target_name(position: str, scaled: bool = False, horizon: int = 1) -> str:
+    """
+    Name of the forward change of a position over horizon reports.
+
+    One report ahead targets keep their historical names (forward_report_X_change and
+    forward_X_to_openinterest_change); longer horizons are named forward_{h}W_report_X_change and
+    forward_{h}W_X_to_openinterest_change.
+    """
+    if horizon == 1:
+        return f'forward_{position}_to_openinterest_change' if scaled else f'forward_report_{position}_change'
+    if scaled:
+        return f'forward_{horizon}W_{position}_to_openinterest_change'
+    return f'forward_{horizon}W_report_{position}_change'
+
+
+def forward_changes(values: np.ndarray, horizons: tuple = HORIZONS) -> np.ndarray:
+    """
+    Forward changes of every column of a time ordered matrix over every horizon.
+
+    Args:
+        values: (n_reports, n_series) levels, oldest report first.
+        horizons: numbers of reports ahead.
+
+    Returns:
+        np.ndarray: (n_reports, n_series, n_horizons) array of values[t + h] - values[t], NaN past the end.
+    """
+    values = np.asarray(values, dtype=float)
+    horizons = np.asarray(horizons, dtype=int)
+    n_reports = values.shape[0]
+    padded = np.vstack([values, np.full((int(horizons.max()), values.shape[1]), np.nan)])
+    ahead = padded[np.arange(n_reports)[:, None] + horizons[None, :]]  # (n_reports, n_horizons, n_series)
+    return ahead.transpose(0, 2, 1) - values[:, :, None]
+
+
+def forward_change(series: pd.Series, horizon: int = 1) -> pd.Series:
+    """ Change of a time ordered series from each report to horizon reports ahead """
+    return pd.Series(forward_changes(series.to_numpy()[:, None], (horizon,))[:, 0, 0], index=series.index)
+
+
+def build_targets(dataset: pd.DataFrame,
+                  positions: list[str],
+                  horizons: tuple = HORIZONS,
+                  scaled: bool = True,
+                  openinterest_column: str = 'AGG_OI') -> pd.DataFrame:
+    """
+    Builds the forward targets of every position, scaling and horizon in one pass over the report series.
+
+    Args:
+        dataset: report series sorted by trade date.
+        positions: position columns.
+        horizons: numbers of reports ahead.
+        scaled: whether to add the targets of the positions scaled by open interest.
+        openinterest_column: open interest column used for the scaling.
+
+    Returns:
+        pd.DataFrame: one column per (position, scaling, horizon) target, indexed like dataset.
+    """
+    levels = dataset[positions].to_numpy(dtype=float)
+    scalings = [False]
+    if scaled:
+        levels = np.hstack([levels, levels / dataset[[openinterest_column]].to_numpy(dtype=float)])
+        scalings.append(True)
+    changes = forward_changes(levels, horizons)
+
+    names = [target_name(position, is_scaled, horizon)
+             for is_scaled in scalings for position in positions for horizon in horizons]
+    return pd.DataFrame(changes.reshape(len(dataset), -1), columns=names, index=dataset.index)
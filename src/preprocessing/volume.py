@@ -1,14 +1,19 @@
 
 import pandas as pd
 
+from src.utils.memory import cast_floats, get_memory_report, validate_float_dtype
+
 class VolumePanel():
 
     def __init__(self,
                  lookback_windows: int = [1, 5, 10, 15, 20],
-                 lookforward_windows: int = [1, 5, 10, 15, 20]) -> None:
+                 lookforward_windows: int = [1, 5, 10, 15, 20],
+                 dtype: str = 'float64') -> None:
         self.lookback_windows = lookback_windows
         self.lookforward_windows = lookforward_windows
+        self.dtype = validate_float_dtype(dtype)
         self.panel = None
+        self.memory_report = None
 
     def compute_backward_features(self, dataset: pd.DataFrame) -> pd.DataFrame:
         dataset.sort_values(by='tradeDate', ascending=True, inplace=True)
@@ -34,5 +39,6 @@ class VolumePanel():
 
         dataset = self.compute_backward_features(dataset)
         dataset = self.compute_forward_features(dataset)
-        self.panel = dataset
+        self.panel = cast_floats(dataset, self.dtype)
+        self.memory_report = get_memory_report(self.panel, name='volume')
 
@@ -1,8 +1,26 @@
+import numpy as np
 import pandas as pd
-from itertools import product
-from typing import List
+from typing import List, Optional, Tuple
 from datetime import date
 
+from src.utils.dates import to_datetime64
+
+
+def get_grid_index(securities: list[str],
+                   dates: list[date]) -> pd.MultiIndex:
+    """
+    Dense (tradeDate, Name) grid of every date and security, dates first.
+
+    Args:
+        securities (List[str]): List of security names.
+        dates (List[date]): List of dates.
+
+    Returns:
+        pd.MultiIndex: grid with levels 'tradeDate' and 'Name'.
+    """
+    return pd.MultiIndex.from_product([dates, securities], names=['tradeDate', 'Name'])
+
+
 def get_cartesian_product(securities: list[str],
                          dates: list[date]) -> pd.DataFrame:
     """
@@ -16,5 +34,82 @@ def get_cartesian_product(securities: list[str],
     Returns:
         pd.DataFrame: DataFrame containing the Cartesian product with columns 'tradeDate' and 'Name'.
     """
-    cartesian_product = list(product(dates, securities))
-    return pd.DataFrame(cartesian_product, columns=['tradeDate', 'Name'])
\ No newline at end of file
+    return get_grid_index(securities, dates).to_frame(index=False)
+
+
+def _forward_fill(values: np.ndarray, limit: Optional[int] = None) -> np.ndarray:
+    """ Forward fills NaNs along the first axis, at most limit steps after the last value """
+    steps = np.arange(values.shape[0]).reshape((-1,) + (1,) * (values.ndim - 1))
+    last_valid = np.where(np.isnan(values), -1, steps)
+    last_valid = np.maximum.accumulate(last_valid, axis=0)
+    fill = last_valid >= 0
+    if limit is not None:
+        fill &= (steps - last_valid) <= limit
+    filled = np.take_along_axis(values, np.maximum(last_valid, 0), axis=0)
+    return np.where(fill, filled, np.nan)
+
+
+def reindex_to_array(data: pd.DataFrame,
+                     securities: list[str],
+                     dates: list[date],
+                     columns: list[str],
+                     ffill_limit: Optional[int] = None,
+                     ffill: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Scatters a long format table onto a dense (date, security, column) array.
+
+    Rows whose tradeDate or Name is not on the grid are dropped; when several rows share a grid cell the
+    last one wins.
+
+    Args:
+        data (pd.DataFrame): long format table with tradeDate, Name and columns.
+        securities (List[str]): securities of the grid.
+        dates (List[date]): sorted dates of the grid.
+        columns (List[str]): numeric columns to reindex.
+        ffill_limit (int, optional): maximum number of consecutive dates a value is carried forward.
+        ffill (bool): whether to forward fill missing cells at all.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (n_dates, n_securities, n_columns) values and a mask of the cells
+        that were missing from data, before the forward fill.
+    """
+    date_positions = pd.Index(to_datetime64(dates)).get_indexer(to_datetime64(data['tradeDate']))
+    security_positions = pd.Index(securities).get_indexer(data['Name'])
+    on_grid = (date_positions >= 0) & (security_positions >= 0)
+
+    values = np.full((len(dates), len(securities), len(columns)), np.nan)
+    values[date_positions[on_grid], security_positions[on_grid]] = data[columns].to_numpy(dtype=float)[on_grid]
+    missing = np.isnan(values)
+    if ffill:
+        values = _forward_fill(values, ffill_limit)
+    return values, missing
+
+
+def reindex_to_grid(data: pd.DataFrame,
+                    securities: list[str],
+                    dates: list[date],
+                    columns: list[str] = None,
+                    ffill_limit: Optional[int] = None,
+                    ffill: bool = True) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Reindexes a long format table onto the dense tradeDate x Name grid.
+
+    Args:
+        data (pd.DataFrame): long format table with tradeDate, Name and columns.
+        securities (List[str]): securities of the grid.
+        dates (List[date]): sorted dates of the grid.
+        columns (List[str], optional): numeric columns to reindex, all but tradeDate and Name by default.
+        ffill_limit (int, optional): maximum number of consecutive dates a value is carried forward.
+        ffill (bool): whether to forward fill missing cells at all.
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame]: the panel and the mask of the cells missing from data, both indexed
+        by the grid of get_grid_index.
+    """
+    if columns is None:
+        columns = [c for c in data.columns if c not in ('tradeDate', 'Name')]
+    values, missing = reindex_to_array(data, securities, dates, columns, ffill_limit=ffill_limit, ffill=ffill)
+    index = get_grid_index(securities, dates)
+    panel = pd.DataFrame(values.reshape(-1, len(columns)), index=index, columns=columns)
+    missing = pd.DataFrame(missing.reshape(-1, len(columns)), index=index, columns=columns)
+    return panel, missing
@@ -1,12 +1,31 @@
 
 from typing import Optional
 import datetime
-import calendar
+import os
+from functools import lru_cache
+from importlib.metadata import version
+from pathlib import Path
 import numpy as np
 import pandas as pd
-from pandas_market_calendars import get_calendar
 
 
+# Holiday calendars are materialized once per library version and span under this directory
+CALENDAR_CACHE_DIR = Path(__file__).resolve().parents[2] / 'cache' / 'calendars'
+HOLIDAY_SPAN = (datetime.date(1980, 1, 1), datetime.date(2050, 12, 31))
+
+# Exchange aliases to pandas_market_calendars names. Expiries and roll distances count settlement days, so CME
+# uses its trade date calendar: the Globex trading calendars stay open on Thanksgiving, MLK Day and the like
+EXCHANGE_CALENDARS = {'CME': 'CME_TradeDate',
+                      'ICE': 'ICE',
+                      'NYSE': 'NYSE'}
+
+# Exchange each futures ticker trades on
+TICKER_EXCHANGES = {'CL': 'CME',
+                    'HO': 'CME',
+                    'XB': 'CME',
+                    'CO': 'ICE',
+                    'QS': 'ICE'}
+
 
 def get_timeOfDay_as_float(dt: datetime.datetime) -> float:
     """ Transform a datetime into a float """
@@ -24,17 +43,54 @@ def get_last_day_of_month(any_day: datetime.date) -> datetime.date:
     return next_month.replace(day=1) - datetime.timedelta(days=1)      # go back one day to last of current month
 
 
+def to_months(years, months) -> np.ndarray:
+    """ Year and month arrays to a datetime64[M] array """
+    years = np.asarray(years, dtype=int)
+    months = np.asarray(months, dtype=int)
+    return ((years - 1970) * 12 + months - 1).astype('datetime64[M]')
+
+
+def get_first_of_next_months(dates) -> np.ndarray:
+    """ Array version of get_first_of_next_month: first day of the month after each date """
+    return (to_datetime64(dates).astype('datetime64[M]') + 1).astype('datetime64[D]')
+
+
+def get_last_days_of_months(dates) -> np.ndarray:
+    """ Array version of get_last_day_of_month: last day of the month of each date """
+    return get_first_of_next_months(dates) - 1
+
+
+def get_nth_business_days_of_months(years, months, n: int, calendar: 'BusinessCalendar') -> np.ndarray:
+    """
+    Array version of get_nth_business_day_of_month.
+
+    Args:
+        years: years of the months.
+        months: months, 1 to 12.
+        n: 1 for the first business day, -1 for the last one.
+        calendar: business calendar.
+
+    Returns:
+        np.ndarray: datetime64[D] array, NaT where a month has fewer than |n| business days.
+    """
+    return calendar.nth_of_month(to_months(years, months), n)
+
+
+def get_last_business_days_of_months(years, months, calendar: 'BusinessCalendar') -> np.ndarray:
+    """ Last business day of each month, see get_nth_business_days_of_months """
+    return get_nth_business_days_of_months(years, months, -1, calendar)
+
+
 def get_nth_business_day_of_month(year: int,
                                   month: int,
                                   n: int,
                                  business_days: list[datetime.date]) -> Optional[datetime.date]:
     """Get the nth business day of a given month"""
-    # Get first and last day of month
-    month_start = datetime.date(year, month, 1)
-    last_day = calendar.monthrange(year, month)[1]
-    month_end = datetime.date(year, month, last_day)
-    month_business_days = [d for d in business_days if month_start <= d <= month_end]
-    return month_business_days[n-1]
+    calendar = business_days if isinstance(business_days, BusinessCalendar) else BusinessCalendar(business_days)
+    day = calendar.nth_of_month(np.array([f'{year:04d}-{month:02d}'], dtype='datetime64[M]'), n)[0]
+    if np.isnat(day):
+        raise IndexError(f"{year}-{month:02d} has fewer than {n} business days")
+    return day.astype(datetime.date)
 
 
 # def count_business_days_series(start_dates: pd.Series,
@@ -102,9 +158,6 @@ def get_nth_business_day_of_month(year: int,
 #
 #     return pd.Series(results, index=start_dates.index)
 
-import pandas as pd
-from datetime import date
-
 def count_business_days_series(start_dates: pd.Series,
                                end_dates: pd.Series,
                                business_days: pd.Series) -> pd.Series:
@@ -114,39 +167,198 @@ def count_business_days_series(start_dates: pd.Series,
     - Negative count if start_date > end_date
     - Zero if start_date == end_date
 
+    The count is the number of business days in (start_date, end_date], read from the ordinal index of a
+    BusinessCalendar, so the cost is O(n + m) rather than O(n * m).
+
     Parameters:
     - start_dates (pd.Series): Series of start dates.
     - end_dates (pd.Series): Series of end dates.
-    - business_days (pd.Series): Series of valid business dates.
+    - business_days (pd.Series or BusinessCalendar): Series of valid business dates.
 
     Returns:
     - pd.Series: Series of business day counts (signed).
     """
-    # Convert to datetime.date
-    start_dates = pd.to_datetime(start_dates).dt.date
-    end_dates = pd.to_datetime(end_dates).dt.date
-    business_days = pd.to_datetime(business_days).dt.date
-
-    # Fast lookup
-    business_days_set = set(business_days)
-
-    results = []
-    for start, end in zip(start_dates, end_dates):
-        if start == end:
-            results.append(0)
+    start_dates = pd.Series(start_dates)
+    calendar = business_days if isinstance(business_days, BusinessCalendar) else BusinessCalendar(business_days)
+    return pd.Series(calendar.count(start_dates, end_dates), index=start_dates.index)
+
+
+def to_datetime64(dates) -> np.ndarray:
+    """ Converts dates (datetime.date, strings, Timestamps, Series or arrays of them) to a datetime64[D] array """
+    return pd.to_datetime(pd.Series(np.asarray(dates).ravel())).values.astype('datetime64[D]')
+
+
+class BusinessCalendar:
+    """
+    Business days of an exchange with a precomputed ordinal index.
+
+    The business days are held as a sorted datetime64[D] array, and a dense array over every calendar day of the
+    span gives the number of business days on or before that day. Counting, offsetting, testing and finding the
+    nth business day of a month are then array lookups, whatever the number of dates asked for.
+
+    Dates outside the span of the calendar are clipped to it.
+
+    Examples
+    --------
+    >>> calendar = BusinessCalendar.from_exchange('NYSE', datetime.date(2000, 1, 1), datetime.date(2030, 12, 31))
+    >>> calendar.count(start_dates, end_dates)
+    >>> calendar.nth_of_month(np.arange('2024-01', '2025-01', dtype='datetime64[M]'), 5)
+    """
+
+    def __init__(self, business_days) -> None:
+        self.days = np.unique(to_datetime64(business_days))
+        if len(self.days) == 0:
+            raise ValueError("A business calendar needs at least one business day")
+        self.start = self.days[0]
+        self.end = self.days[-1]
+        is_business_day = np.zeros(int((self.end - self.start).astype(int)) + 1, dtype=bool)
+        is_business_day[(self.days - self.start).astype(int)] = True
+        self._is_business_day = is_business_day
+        # number of business days on or before each calendar day of the span
+        self._ordinals = np.cumsum(is_business_day)
+
+    @classmethod
+    def from_holidays(cls,
+                      start_date: datetime.date,
+                      end_date: datetime.date,
+                      holidays=(),
+                      weekmask: str = '1111100') -> 'BusinessCalendar':
+        """ Calendar of the days between start_date and end_date that are neither weekend days nor holidays """
+        days = np.arange(np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D') + 1)
+        holidays = to_datetime64(holidays) if len(holidays) else np.array([], dtype='datetime64[D]')
+        return cls(days[np.is_busday(days, weekmask=weekmask, holidays=holidays)])
+
+    @classmethod
+    def from_exchange(cls,
+                      exchange_name: str,
+                      start_date: datetime.date,
+                      end_date: datetime.date) -> 'BusinessCalendar':
+        """
+        Calendar of the weekdays between start_date and end_date that are not holidays of the exchange.
+
+        exchange_name is an alias of EXCHANGE_CALENDARS (CME, ICE, NYSE) or a pandas_market_calendars name.
+        """
+        return cls.from_holidays(start_date, end_date, holidays=get_exchange_holidays(exchange_name))
+
+    @classmethod
+    def from_ticker(cls,
+                    ticker,
+                    start_date: datetime.date,
+                    end_date: datetime.date) -> 'BusinessCalendar':
+        """ Calendar of the exchange a futures ticker (FutureTicker or symbol such as 'CL') trades on """
+        return cls.from_exchange(TICKER_EXCHANGES[getattr(ticker, 'value', ticker)], start_date, end_date)
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def _positions(self, dates) -> np.ndarray:
+        """ Offsets of dates from the start of the span, clipped to the span """
+        offsets = (to_datetime64(dates) - self.start).astype(int)
+        return np.clip(offsets, -1, len(self._ordinals))
+
+    def ordinals(self, dates) -> np.ndarray:
+        """ Number of business days on or before each date """
+        positions = self._positions(dates)
+        ordinals = self._ordinals[np.clip(positions, 0, len(self._ordinals) - 1)]
+        return np.where(positions < 0, 0, ordinals)
+
+    def is_business_day(self, dates) -> np.ndarray:
+        """ Boolean mask of the dates that are business days """
+        positions = self._positions(dates)
+        inside = (positions >= 0) & (positions < len(self._is_business_day))
+        return inside & self._is_business_day[np.clip(positions, 0, len(self._is_business_day) - 1)]
+
+    def count(self, start_dates, end_dates) -> np.ndarray:
+        """ Signed number of business days in (start_date, end_date] """
+        return self.ordinals(end_dates) - self.ordinals(start_dates)
+
+    def offset(self, dates, n) -> np.ndarray:
+        """ Business day n business days after (before if negative) the last business day on or before each date """
+        positions = self.ordinals(dates) - 1 + np.asarray(n)
+        return self.days[np.clip(positions, 0, len(self.days) - 1)]
+
+    def nth_of_month(self, months, n: int) -> np.ndarray:
+        """
+        nth business day of each month.
+
+        Args:
+            months: months as a datetime64[M] array (or anything to_datetime64 understands).
+            n: 1 for the first business day, -1 for the last one.
+
+        Returns:
+            np.ndarray: datetime64[D] array, NaT where the month has fewer than |n| business days.
+        """
+        months = np.asarray(months).astype('datetime64[M]')
+        month_starts = months.astype('datetime64[D]')
+        if n > 0:
+            positions = self.ordinals(month_starts - 1) + n - 1
         else:
-            # Define the range boundaries
-            start_bound = min(start, end)
-            end_bound = max(start, end)
-            count = sum(start_bound < day <= end_bound for day in business_days_set)
+            positions = self.ordinals((months + 1).astype('datetime64[D]') - 1) + n
+        valid = (positions >= 0) & (positions < len(self.days))
+        days = np.full(len(months), np.datetime64('NaT'), dtype='datetime64[D]')
+        days[valid] = self.days[positions[valid]]
+        days[days.astype('datetime64[M]') != months] = np.datetime64('NaT')
+        return days
+
+    def between(self, start_date: datetime.date, end_date: datetime.date) -> np.ndarray:
+        """ Business days between start_date and end_date, both included """
+        return self.days[(self.days >= np.datetime64(start_date, 'D')) & (self.days <= np.datetime64(end_date, 'D'))]
 
-            # Apply sign
-            if start > end:
-                count = -count
-            results.append(count)
+    def to_list(self) -> list[datetime.date]:
+        """ Business days as a list of datetime.date """
+        return self.days.astype(datetime.date).tolist()
 
-    return pd.Series(results, index=start_dates.index)
 
+def _holiday_cache_path(calendar_name: str, cache_dir: Path = None) -> Path:
+    """ Cache file of a calendar, keyed by the pandas_market_calendars version and the holiday span """
+    start, end = HOLIDAY_SPAN
+    return (Path(cache_dir or CALENDAR_CACHE_DIR)
+            / f"{calendar_name}_pmc{version('pandas_market_calendars')}_{start:%Y%m%d}_{end:%Y%m%d}.npy")
+
+
+def _build_holidays(calendar_name: str) -> np.ndarray:
+    """ Holidays of a calendar within HOLIDAY_SPAN, from pandas_market_calendars """
+    from pandas_market_calendars import get_calendar
+
+    start, end = HOLIDAY_SPAN
+    holidays = np.unique(np.array(get_calendar(calendar_name).holidays().holidays, dtype='datetime64[D]'))
+    return holidays[(holidays >= np.datetime64(start, 'D')) & (holidays <= np.datetime64(end, 'D'))]
+
+
+@lru_cache(maxsize=None)
+def get_exchange_holidays(exchange_name: str, cache_dir: Path = None) -> np.ndarray:
+    """
+    Holidays of an exchange as a sorted datetime64[D] array.
+
+    Holidays are read from the on-disk cache, and only built with pandas_market_calendars (then saved) when
+    the cache has no file for the installed library version and HOLIDAY_SPAN. Within a process the array is
+    loaded once.
+
+    Args:
+        exchange_name: alias of EXCHANGE_CALENDARS (CME, ICE, NYSE) or a pandas_market_calendars name.
+        cache_dir: cache directory, CALENDAR_CACHE_DIR by default.
+
+    Returns:
+        np.ndarray: holidays within HOLIDAY_SPAN.
+    """
+    calendar_name = EXCHANGE_CALENDARS.get(exchange_name, exchange_name)
+    path = _holiday_cache_path(calendar_name, cache_dir)
+    if path.exists():
+        return np.load(path)
+    holidays = _build_holidays(calendar_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # write then rename so that concurrent readers never see a partial file
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, holidays)
+    os.replace(tmp_path, path)
+    return holidays
+
+
+def build_holiday_cache(exchange_names: list[str] = list(EXCHANGE_CALENDARS), cache_dir: Path = None) -> None:
+    """ Materializes the holiday cache of the exchanges, e.g. once at deployment """
+    for exchange_name in exchange_names:
+        get_exchange_holidays(exchange_name, cache_dir)
 
 
 def get_holidays(
@@ -165,20 +377,12 @@ def get_holidays(
     Returns:
         List[ datetime.date]: List of holidays between start_date and end_date.
     """
-
-    holidays = pd.to_datetime(pd.Series(get_calendar(exchange_name).holidays().holidays)).dt.date
-
-    return holidays[( holidays>= start_date ) & (holidays <= end_date ) ].unique().tolist()
+    holidays = get_exchange_holidays(exchange_name)
+    holidays = holidays[(holidays >= np.datetime64(start_date, 'D')) & (holidays <= np.datetime64(end_date, 'D'))]
+    return holidays.astype(datetime.date).tolist()
 
 def get_nyse_business_dates(start_date: datetime.date,
                             end_date:  datetime.date
                         ) -> list[ datetime.date]:
     """ Get  business dates between two dates """
-    dates = pd.date_range(start_date, end_date, freq = 'D')
-    weekend_mask = (dates.dayofweek ==5) | (dates.dayofweek == 6)
-    holidays = get_holidays(exchange_name =  'NYSE', start_date = start_date, end_date = end_date)
-    holiday_mask = dates.isin(holidays)
-    non_business_day_mask = weekend_mask | holiday_mask
-    business_dates = pd.to_datetime(pd.Series ( list( dates[~non_business_day_mask] ) ) ).dt.date.tolist()
-
-    return business_dates
+    return BusinessCalendar.from_exchange('NYSE', start_date, end_date).to_list()
@@ -0,0 +1,90 @@
+from dataclasses import dataclass
+from typing import Optional
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from src.utils.dates import BusinessCalendar
+
+
+@dataclass(frozen=True)
+class ExpiryRule:
+    """
+    Last trading day of a contract, as an offset in business days from an anchor day.
+
+    The anchor is the given day (the last calendar day when None) of the month months_before the delivery
+    month. The expiry is offset business days from the last business day on or before the anchor.
+    """
+    months_before: int
+    day: Optional[int]
+    offset: int
+
+
+# Last trading day rules by ticker symbol
+EXPIRY_RULES = {
+    # 3 business days before the 25th of the prior month (or before the business day preceding it)
+    'CL': ExpiryRule(months_before=1, day=25, offset=-3),
+    # last business day of the prior month
+    'HO': ExpiryRule(months_before=1, day=None, offset=0),
+    'XB': ExpiryRule(months_before=1, day=None, offset=0),
+    # last business day of the second month preceding the delivery month
+    'CO': ExpiryRule(months_before=2, day=None, offset=0),
+    # 2 business days before the 14th of the delivery month, i.e. 1 before the last one on or before the 13th
+    'QS': ExpiryRule(months_before=0, day=13, offset=-1),
+}
+
+
+def get_expiry_dates(ticker, contract_months: np.ndarray, calendar: BusinessCalendar) -> np.ndarray:
+    """
+    Last trading day of each contract month.
+
+    Args:
+        ticker: futures ticker, FutureTicker or symbol such as 'CL'.
+        contract_months: delivery months as a datetime64[M] array.
+        calendar: business calendar of the exchange.
+
+    Returns:
+        np.ndarray: datetime64[D] expiry of each contract month.
+    """
+    symbol = getattr(ticker, 'value', ticker)
+    if symbol not in EXPIRY_RULES:
+        raise ValueError(f"No expiry rule for ticker {ticker}")
+    rule = EXPIRY_RULES[symbol]
+    anchor_months = np.asarray(contract_months).astype('datetime64[M]') - rule.months_before
+    if rule.day is None:
+        anchors = (anchor_months + 1).astype('datetime64[D]') - 1
+    else:
+        anchors = anchor_months.astype('datetime64[D]') + rule.day - 1
+    return calendar.offset(anchors, rule.offset)
+
+
+def get_expiry_schedule(tickers: list,
+                        start_date: datetime.date,
+                        end_date: datetime.date,
+                        calendars: dict = None) -> pd.DataFrame:
+    """
+    Expiry dates of every contract month of every ticker between two dates.
+
+    Args:
+        tickers: futures tickers, FutureTicker or symbols.
+        start_date: first contract month.
+        end_date: last contract month.
+        calendars: business calendar by ticker symbol. By default, the calendar of the exchange of each ticker.
+
+    Returns:
+        pd.DataFrame: Name, contractMonth and expiryDate, one row per ticker and contract month.
+    """
+    contract_months = np.arange(np.datetime64(start_date, 'M'), np.datetime64(end_date, 'M') + 1)
+    # the calendar must cover the anchors, up to two months before the first contract month
+    span = (contract_months[0] - 3).astype(datetime.date), (contract_months[-1] + 1).astype(datetime.date)
+    schedules = []
+    for ticker in tickers:
+        symbol = getattr(ticker, 'value', ticker)
+        calendar = (calendars or {}).get(symbol)
+        if calendar is None:
+            calendar = BusinessCalendar.from_ticker(symbol, *span)
+        schedules.append(pd.DataFrame({'Name': symbol,
+                                       'contractMonth': contract_months,
+                                       'expiryDate': get_expiry_dates(symbol, contract_months, calendar)}))
+    return pd.concat(schedules, ignore_index=True)
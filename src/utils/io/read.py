@@ -4,6 +4,7 @@ import pickle
 import pandas as pd
 
 from src.preprocessing.base import FutureTicker
+from src.utils.memory import cast_floats
 
 class RawDataReader():
     def __init__(self, raw_data_directory: Path):
@@ -28,11 +29,12 @@ class RawDataReader():
         return self._read(file_name)
 
 class PreprocessedDataReader():
-    def __init__(self, preprocessed_data_directory: Path):
+    def __init__(self, preprocessed_data_directory: Path, dtype: str = 'float64'):
         self.preprocessed_data_directory = preprocessed_data_directory
+        self.dtype = dtype
 
     def _read(self, fname:str)->pd.DataFrame:
-        return pd.read_csv(fname)
+        return cast_floats(pd.read_csv(fname), self.dtype)
 
     def read_prices(self, ticker: FutureTicker) -> pd.DataFrame:
         file_name = str(self.preprocessed_data_directory   ) + f"/{ticker.name}_prices_panel.csv"
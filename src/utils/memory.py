@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+SUPPORTED_FLOAT_DTYPES = ('float64', 'float32')
+
+
+def validate_float_dtype(dtype: str) -> str:
+    """ Validates the float dtype requested for a panel and returns its canonical name """
+    dtype = np.dtype(dtype).name
+    if dtype not in SUPPORTED_FLOAT_DTYPES:
+        raise ValueError(f"dtype must be one of {SUPPORTED_FLOAT_DTYPES}, got {dtype}")
+    return dtype
+
+
+def cast_floats(dataset: pd.DataFrame, dtype: str = 'float32') -> pd.DataFrame:
+    """
+    Casts every float column of a DataFrame to the requested float dtype.
+
+    Non-float columns (dates, names, integers) are left untouched.
+
+    Args:
+        dataset (pd.DataFrame): DataFrame to cast.
+        dtype (str): target float dtype ('float32' or 'float64').
+
+    Returns:
+        pd.DataFrame: DataFrame with float columns cast to dtype.
+    """
+    dtype = validate_float_dtype(dtype)
+    float_columns = dataset.select_dtypes(include='floating').columns
+    if len(float_columns) == 0:
+        return dataset
+    return dataset.astype({c: dtype for c in float_columns}, copy=False)
+
+
+def get_memory_report(dataset: pd.DataFrame, name: str) -> dict:
+    """
+    Summarizes the memory footprint of a panel.
+
+    Args:
+        dataset (pd.DataFrame): panel to measure.
+        name (str): name of the panel in the report.
+
+    Returns:
+        dict: rows, columns, float columns, current bytes and the bytes the same panel takes at float64.
+    """
+    column_bytes = dataset.memory_usage(index=True, deep=True)
+    float_columns = dataset.select_dtypes(include='floating').columns
+    float_bytes = int(column_bytes[float_columns].sum())
+    float64_float_bytes = len(dataset) * len(float_columns) * np.dtype('float64').itemsize
+    total_bytes = int(column_bytes.sum())
+    float64_total_bytes = total_bytes - float_bytes + float64_float_bytes
+    return {'panel': name,
+            'rows': len(dataset),
+            'columns': dataset.shape[1],
+            'float_columns': len(float_columns),
+            'memory_mb': total_bytes / 2 ** 20,
+            'float64_memory_mb': float64_total_bytes / 2 ** 20,
+            'saving_ratio': 1 - total_bytes / float64_total_bytes if float64_total_bytes else 0.0}
+
+
+def check_precision(reference: pd.DataFrame,
+                    compact: pd.DataFrame,
+                    features: list[str],
+                    tolerance: float = 1e-4) -> pd.DataFrame:
+    """
+    Checks that features kept in a compact dtype stay close to their full precision values.
+
+    The error of each feature is the largest absolute difference between the two versions scaled by the
+    standard deviation of the reference, so that features that are differences around zero are not
+    penalized by an element-wise relative error.
+
+    Args:
+        reference (pd.DataFrame): full precision values.
+        compact (pd.DataFrame): values in the compact dtype, aligned with reference.
+        features (list[str]): features to check.
+        tolerance (float): maximum accepted scaled error.
+
+    Returns:
+        pd.DataFrame: the scaled error of each feature.
+
+    Raises:
+        ValueError: if any feature exceeds the tolerance.
+    """
+    errors = {}
+    for feature in features:
+        full = reference[feature].to_numpy(dtype='float64')
+        approx = compact[feature].to_numpy(dtype='float64')
+        scale = np.nanstd(full)
+        max_abs_error = np.nanmax(np.abs(approx - full), initial=0.0)
+        errors[feature] = max_abs_error / scale if scale > 0 else max_abs_error
+    precision = pd.DataFrame({'Feature': list(errors.keys()), 'scaled_error': list(errors.values())})
+    failing = precision[precision['scaled_error'] > tolerance]['Feature'].tolist()
+    if failing:
+        raise ValueError(f"Features losing precision beyond {tolerance}: {failing}")
+    return precision